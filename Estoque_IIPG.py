@@ -1,173 +1,409 @@
+import time
+
+# Início da importação do app, para o tempo de partida logado no fim do módulo
+_inicio_importacao = time.perf_counter()
+
 import dash
+import flask
 from dash import dcc, html
-from dash.dependencies import Input, Output
-import pandas as pd
-import plotly.express as px
+from dash.dependencies import ClientsideFunction, Input, Output
+from dash.exceptions import PreventUpdate
+from plotly.colors import qualitative
 import plotly.graph_objs as go
-import requests
-from io import BytesIO
+import logging
 import os
 
+import alertas
+import dados
+import exportacao
+import metricas
+from cache import em_cache
+from importacao import tardia
+
+log = logging.getLogger('estoque.app')
+
 # URL direta para a imagem no GitHub
 image_url = 'https://github.com/JacoLucas/EstoqueIIPG/raw/main/LOGO MLC Infra.jpg'
 
-# URLs das planilhas no GitHub (substituindo espaços por %20)
-url_base = 'https://github.com/JacoLucas/EstoqueIIPG/raw/main/Long_Estoque IIPG.xlsx'
+# Nenhum dado é carregado na importação: o atualizador em segundo plano, iniciado em cada
+# processo que atende requisições (aqui embaixo no servidor de desenvolvimento e no
+# post_fork do gunicorn.conf.py em produção), carrega o snapshot local e consulta a fonte.
+# Até lá a página mostra o carregamento
+
+# Respostas comprimidas (gzip/brotli, conforme o navegador aceitar)
+COMPRESSAO = os.environ.get('ESTOQUE_COMPRESSAO', '1') == '1'
+
+# Ponto de entrada WSGI (gunicorn Estoque_IIPG:server)
+server = flask.Flask(__name__)
+
+
+@server.before_request
+def iniciar_medida():
+    if flask.request.path.endswith('/_dash-update-component'):
+        flask.g.inicio = time.perf_counter()
+        flask.g.perfil = metricas.iniciar_perfil()
+
+
+# Registrado antes da compressão do Dash, então roda depois dela (o Flask executa os
+# after_request na ordem inversa) e mede os bytes que de fato vão para a rede e o tempo
+# total da requisição
+@server.after_request
+def medir_callback(response):
+    if flask.request.path.endswith('/_dash-update-component') and not response.direct_passthrough:
+        # O 'output' vem do cliente: só os callbacks registrados viram rótulo, para que
+        # requisições forjadas não criem séries novas (memória e /metrics sem limite)
+        callback = (flask.request.get_json(silent=True) or {}).get('output')
+        if not isinstance(callback, str) or callback not in app.callback_map:
+            callback = 'desconhecido'
+        originais = flask.g.get('bytes_originais', response.calculate_content_length() or 0)
+        metricas.registrar_bytes(callback, originais, response.calculate_content_length() or 0)
+        if 'inicio' in flask.g:
+            segundos = time.perf_counter() - flask.g.inicio
+            metricas.observar('estoque_callback_segundos', segundos, callback=callback)
+            metricas.finalizar_perfil(flask.g.perfil, callback, segundos)
+    return response
+
+
+# Métricas deste processo no formato do Prometheus
+@server.route('/metrics')
+def metrics():
+    return flask.Response(metricas.exportar(), mimetype='text/plain; version=0.0.4')
+
+
+# Relatórios em CSV/XLSX/JSON para outros sistemas (ver exportacao.py)
+server.register_blueprint(exportacao.rotas)
+server.register_blueprint(alertas.rotas)
 
-def carregar_planilha(url, sheet_name):
-    response = requests.get(url)
-    if response.status_code == 200:
-        df = pd.read_excel(BytesIO(response.content), sheet_name=sheet_name, engine='openpyxl')
-        return df
-    else:
-        raise Exception("Falha ao baixar o arquivo do GitHub. Verifique a URL e tente novamente.")
-
-# Carregando os dados das planilhas
-df1 = carregar_planilha(url_base, 'PRIMARIO')
-df2 = carregar_planilha(url_base, 'SECUNDARIO')
-df_usauss = carregar_planilha(url_base, 'USA&USS')
-df1 = df1.fillna(0)
-df2 = df2.fillna(0)
-df_usauss = df_usauss.fillna(0)
-
-df1.rename(columns={
-    'Estoque RD': 'Rocha Detonada',
-    'Estoque Rachão': 'Rachão'
-}, inplace=True)
-
-df1['Dias'] = pd.to_datetime(df1['Dias'], format='%d/%m/%Y')
-df2['Dias'] = pd.to_datetime(df2['Dias'], format='%d/%m/%Y')
-df_usauss['Dias'] = pd.to_datetime(df_usauss['Dias'], format='%d/%m/%Y')
-
-# Criando uma coluna 'Mês' no formato 'YYYY-MM'
-df1['Mês'] = df1['Dias'].dt.to_period('M')
-df2['Mês'] = df2['Dias'].dt.to_period('M')
-df_usauss['Mês'] = df_usauss['Dias'].dt.to_period('M')
 
 # Inicializando o app Dash
-app = dash.Dash(__name__)
+# Os componentes dos callbacks só existem no layout completo, não no de carregamento
+app = dash.Dash(__name__, server=server, compress=COMPRESSAO, suppress_callback_exceptions=True)
 app.title = 'Estoque IIPG'
 
-# Layout do aplicativo
-app.layout = html.Div([
-    html.Img(src= image_url, 
-             style={'position': 'absolute', 'top': '10px', 'right': '10px', 'width': '220px', 'height': '180px'}),
 
-    html.H1('Estoque de Materiais Inst. Ind. Ponta Grossa - IIPG'),
-    
-    ######### ATUALIZAR SEMPRE #########
-    html.H3('Atualizado dia 26/02/2025 - 17:22'), 
-    ######### ATUALIZAR SEMPRE #########
-    
-    html.Div([
-    html.Label('Selecione o Período:'),
-    dcc.Dropdown(
-        id='month-dropdown',
-        options=[{'label': str(month), 'value': str(month)} for month in df1['Mês'].unique()],
-        value=str(df1['Mês'].unique()[0])
-    )], style= {'width': '33%', 'display': 'inline-block', 'margin-bottom': '20px'}),
-    
-html.Div([
-    html.H2('Sistema Primário - Britagem'),
-    dcc.Graph(id='line1-graph', style={'width': '70%', 'display': 'inline-block'}),
-    dcc.Graph(id='pie1-graph', style={'width': '30%', 'display': 'inline-block'})
-    ]),
-html.Div([
-    html.H2('Sistema Secundário - Rebritagem'),
-    dcc.Graph(id='line2-graph', style={'width': '70%', 'display': 'inline-block'}),
-    dcc.Graph(id='pie2-graph', style={'width': '30%', 'display': 'inline-block'}),
-    ]),
-html.Div([
-    dcc.Graph(id='bar1-graph', style={'width': '70%', 'display': 'inline-block'}),
-    html.Div(id='table-div', style={'width': '30%', 'display': 'inline-block', 'vertical-align': 'middle', 'margin-left': 'auto', 'margin-right': '0%', 'text-align': 'center'})
-], style={'display': 'flex', 'align-items': 'center'}
-    ),
-html.Div([
-    html.H2('Produção USA e USS'),
-    html.Div([
-        html.Label('Selecione a Usina:'),
-        dcc.Dropdown(
-            id='unit-dropdown',
-            options=[
-                {'label': 'USA', 'value': 'USA'},
-                {'label': 'USS', 'value': 'USS'}
-            ],
-            value='USA',
-            clearable=False
-        )
-    ], style={'width': '33%', 'margin-bottom': '20px'}),
-    dcc.Graph(id='usa-uss-graph', style={'width': '95%', 'display': 'inline-block'}),
-    html.Div(id='usa-uss-pie-graphs', style={'width': '100%', 'display': 'inline-block'})
-    ], style={'margin-top': '20px'})
-])
-# Callback para atualizar o gráfico com base no mês selecionado
+@server.after_request
+def medir_bytes_originais(response):
+    if flask.request.path.endswith('/_dash-update-component') and not response.direct_passthrough:
+        flask.g.bytes_originais = response.calculate_content_length() or 0
+    return response
+
+
+# Template enxuto compartilhado por todas as figuras: o 'plotly' padrão leva em cada
+# figura vários KB de escalas de cor e estilos de tipos de gráfico que não usamos
+TEMPLATE_LEVE = go.layout.Template(layout=dict(
+    colorway=qualitative.Plotly,
+    font=dict(color='#2a3f5f'),
+    paper_bgcolor='white',
+    plot_bgcolor='#E5ECF6',
+    xaxis=dict(gridcolor='white', linecolor='white', zerolinecolor='white', ticks='', automargin=True),
+    yaxis=dict(gridcolor='white', linecolor='white', zerolinecolor='white', ticks='', automargin=True),
+    hovermode='closest',
+    title=dict(x=0.05)
+))
+
+# pandas e plotly.express (que importa o pandas) só são importados na primeira figura
+np = tardia('numpy')
+pd = tardia('pandas')
+px = tardia('plotly.express', ao_carregar=lambda px: setattr(px.defaults, 'template', TEMPLATE_LEVE))
+
+# Modo cliente: os dados de todos os meses vão uma vez para o navegador (dcc.Store) e os
+# gráficos são montados lá (assets/estoque_cliente.js), sem ida ao servidor a cada troca
+MODO_CLIENTE = os.environ.get('ESTOQUE_MODO_CLIENTE', '0') == '1'
+
+# Página enquanto não há dados: recarrega sozinha assim que o snapshot estiver pronto
+def layout_carregando():
+    return html.Div([
+        html.H1('Estoque de Materiais Inst. Ind. Ponta Grossa - IIPG'),
+        html.H3('Carregando os dados...'),
+        dcc.Location(id='carregando-url', refresh=True),
+        dcc.Interval(id='carregando-intervalo', interval=1000)
+    ])
+
+
 @app.callback(
-    [Output('line1-graph', 'figure'),
-    Output('pie1-graph', 'figure'),
-    Output('line2-graph', 'figure'),
-    Output('pie2-graph', 'figure'),
-    Output('bar1-graph', 'figure'),
-    Output('table-div', 'children'),
-    Output('usa-uss-graph', 'figure'),
-    Output('usa-uss-pie-graphs', 'children')],
-    [Input('month-dropdown', 'value'),
-     Input('unit-dropdown', 'value')]
+    Output('carregando-url', 'href'),
+    [Input('carregando-intervalo', 'n_intervals')],
+    prevent_initial_call=True
 )
+def recarregar_quando_pronto(_):
+    if dados.snapshot_atual() is None:
+        raise PreventUpdate
+    return app.get_relative_path('/')
 
-def update_graph(selected_month, selected_unit):
 
-    # DEFINIÇÃO DE CORES #
+# Layout do aplicativo (montado a cada acesso, a partir do snapshot atual)
+def layout():
+    snapshot = dados.snapshot_atual()
+    if snapshot is None:
+        return layout_carregando()
+    meses = snapshot.dfs['PRIMARIO']['Mês'].unique()
+    inicio, fim = periodo_recente(snapshot, PERIODO_PADRAO)
+
+    return html.Div([
+        html.Img(src= image_url, 
+                 style={'position': 'absolute', 'top': '10px', 'right': '10px', 'width': '220px', 'height': '180px'}),
+
+        html.H1('Estoque de Materiais Inst. Ind. Ponta Grossa - IIPG'),
+
+        html.H3(f"Atualizado dia {snapshot.atualizado_em:%d/%m/%Y - %H:%M}"),
 
-    color_line1 = {'Rocha Detonada': '#006699', 
+        *([dcc.Store(id='dados-estoque', data=dados_cliente(snapshot))] if MODO_CLIENTE else []),
+
+        html.Div([
+        html.Label('Selecione o Período:'),
+        dcc.Dropdown(
+            id='month-dropdown',
+            options=[{'label': str(month), 'value': str(month)} for month in meses],
+            value=str(meses[0])
+        )], style= {'width': '33%', 'display': 'inline-block', 'margin-bottom': '20px'}),
+
+    # Uma aba por seção: só a aba visível tem seus gráficos calculados
+    dcc.Tabs(id='secoes-tabs', value='primario', children=[
+    dcc.Tab(label='Sistema Primário', value='primario', children=[
+    html.Div([
+        html.H2('Sistema Primário - Britagem'),
+        dcc.Graph(id='line1-graph', style={'width': '70%', 'display': 'inline-block'}),
+        dcc.Graph(id='pie1-graph', style={'width': '30%', 'display': 'inline-block'})
+        ])]),
+    dcc.Tab(label='Sistema Secundário', value='secundario', children=[
+    html.Div([
+        html.H2('Sistema Secundário - Rebritagem'),
+        dcc.Graph(id='line2-graph', style={'width': '70%', 'display': 'inline-block'}),
+        dcc.Graph(id='pie2-graph', style={'width': '30%', 'display': 'inline-block'}),
+        ]),
+    html.Div([
+        dcc.Graph(id='bar1-graph', style={'width': '70%', 'display': 'inline-block'}),
+        html.Div(id='table-div', style={'width': '30%', 'display': 'inline-block', 'vertical-align': 'middle', 'margin-left': 'auto', 'margin-right': '0%', 'text-align': 'center'})
+    ], style={'display': 'flex', 'align-items': 'center'}
+        )]),
+    dcc.Tab(label='USA e USS', value='usa-uss', children=[
+    html.Div([
+        html.H2('Produção USA e USS'),
+        html.Div([
+            html.Label('Selecione a Usina:'),
+            dcc.Dropdown(
+                id='unit-dropdown',
+                options=[
+                    {'label': 'USA', 'value': 'USA'},
+                    {'label': 'USS', 'value': 'USS'}
+                ],
+                value='USA',
+                clearable=False
+            )
+        ], style={'width': '33%', 'margin-bottom': '20px'}),
+        dcc.Graph(id='usa-uss-graph', style={'width': '95%', 'display': 'inline-block'}),
+        html.Div(id='usa-uss-pie-graphs', style={'width': '100%', 'display': 'inline-block'})
+        ], style={'margin-top': '20px'})]),
+    dcc.Tab(label='Comparação entre Períodos', value='comparacao', children=[
+    html.Div([
+        html.H2('Comparação entre Períodos'),
+        html.Div([
+            html.Label('Selecione o Intervalo:'),
+            dcc.DatePickerRange(
+                id='periodo-range',
+                min_date_allowed=snapshot.dfs['PRIMARIO']['Dias'].min().date(),
+                max_date_allowed=snapshot.dfs['PRIMARIO']['Dias'].max().date(),
+                start_date=inicio.date(),
+                end_date=fim.date(),
+                display_format='DD/MM/YYYY'
+            )], style={'display': 'inline-block', 'margin-right': '40px'}),
+        html.Div([
+            html.Label('Últimos:'),
+            dcc.RadioItems(
+                id='periodo-atalho',
+                options=[{'label': f'{n} meses', 'value': n} for n in [3, 6, 12]],
+                value=PERIODO_PADRAO,
+                inline=True
+            )], style={'display': 'inline-block', 'margin-right': '40px'}),
+        html.Div([
+            html.Label('Agrupar por:'),
+            dcc.RadioItems(
+                id='granularidade-radio',
+                options=[{'label': 'Mês', 'value': 'mes'}, {'label': 'Semana', 'value': 'semana'}],
+                value='mes',
+                inline=True
+            )], style={'display': 'inline-block'}),
+        dcc.Graph(id='comparacao-diario-graph', style={'width': '95%', 'display': 'inline-block'}),
+        dcc.Graph(id='comparacao-estoque-graph', style={'width': '95%', 'display': 'inline-block'}),
+        dcc.Graph(id='comparacao-saidas-graph', style={'width': '95%', 'display': 'inline-block'}),
+        dcc.Graph(id='comparacao-usinas-graph', style={'width': '95%', 'display': 'inline-block'})
+        ], style={'margin-top': '20px'})])
+    ])
+    ])
+
+# DEFINIÇÃO DE CORES #
+
+color_line1 = {'Rocha Detonada': '#006699', 
                'Rachão': '#990033'}
 
-    color_pie1 = {'Vendas': '#006699', 
-                  'Obras': '#660099', 
-                  'Estoque': '#990033'}
-
-    color_line2 = {'Macadame': '#3399FF',
-            'Pó de Pedra': '#006699',
-            'Pedrisco': '#660099',
-            'Brita 1': '#990033',
-            'Brita 2': '#FFCC00'}
-
-    color_pie2 = {'Pó de Pedra': '#006699',
-            'Pedrisco': '#660099',
-            'Brita 1': '#990033',
-            'Brita 2': '#FFCC00'}
-
-    color_bar1 = {'Vendas': '#990033', 
-                  'Obras': '#006699'}
-
-    color_fig_USA = {'Cimento Asfáltico': '#339966',
-            'Pó de Pedra': '#006699',
-            'Pedrisco': '#660099',
-            'Brita 1': '#990033',
-            'Brita 2': '#FFCC00',
-            'Enchimento': '#CC0099'}
-
-    color_fig_USS = {'Pó de Pedra': '#006699',
-            'Pedrisco': '#660099',
-            'Brita 1': '#990033',
-            'Brita 2': '#FFCC00',
-            'Cimento': '#CC0066'}
-
-    color_pie_cbuq = {'Vendas CBUQ': '#990033', 
-                'Obras CBUQ': '#006699'}
-    color_pie_binder = {'Vendas Binder': '#990033', 
-                'Obras Binder': '#006699'}
-    color_pie_bgs = {'Vendas BGS': '#990033', 
-                'Obras BGS': '#006699'}
-    color_pie_bgmc = {'Vendas BGMC': '#990033', 
-                'Obras BGMC': '#006699'}
-    color_pie_bgtc = {'Vendas BGTC': '#990033', 
-                'Obras BGTC': '#006699'}
-
-    # SISTEMA PRIMÁRIO #
-
-    filtered_data1 = df1[df1['Mês'] == selected_month]
-
-    fig_line1 = px.line(filtered_data1, 
+color_pie1 = {'Vendas': '#006699', 
+              'Obras': '#660099', 
+              'Estoque': '#990033'}
+
+color_line2 = {'Macadame': '#3399FF',
+               'Pó de Pedra': '#006699',
+               'Pedrisco': '#660099',
+               'Brita 1': '#990033',
+               'Brita 2': '#FFCC00'}
+
+color_pie2 = {'Pó de Pedra': '#006699',
+              'Pedrisco': '#660099',
+              'Brita 1': '#990033',
+              'Brita 2': '#FFCC00'}
+
+color_bar1 = {'Vendas': '#990033', 
+              'Obras': '#006699'}
+
+color_fig_USA = {'Cimento Asfáltico': '#339966',
+                 'Pó de Pedra': '#006699',
+                 'Pedrisco': '#660099',
+                 'Brita 1': '#990033',
+                 'Brita 2': '#FFCC00',
+                 'Enchimento': '#CC0099'}
+
+color_fig_USS = {'Pó de Pedra': '#006699',
+                 'Pedrisco': '#660099',
+                 'Brita 1': '#990033',
+                 'Brita 2': '#FFCC00',
+                 'Cimento': '#CC0066'}
+
+color_usinas = {'USA': '#339966',
+                'USS': '#CC0066'}
+
+color_pie_cbuq = {'Vendas CBUQ': '#990033', 
+                  'Obras CBUQ': '#006699'}
+color_pie_binder = {'Vendas Binder': '#990033', 
+                    'Obras Binder': '#006699'}
+color_pie_bgs = {'Vendas BGS': '#990033', 
+                 'Obras BGS': '#006699'}
+color_pie_bgmc = {'Vendas BGMC': '#990033', 
+                  'Obras BGMC': '#006699'}
+color_pie_bgtc = {'Vendas BGTC': '#990033', 
+                  'Obras BGTC': '#006699'}
+
+MATERIAIS_SECUNDARIO = ['Macadame', 'Pó de Pedra', 'Pedrisco', 'Brita 1', 'Brita 2']
+
+# Materiais de cada usina: colunas da planilha -> nome exibido, gráficos de pizza
+# (produto, cores, posição do título) e largura de cada pizza
+USINAS = {
+    'USA': {
+        'colunas': {'Cimento Asfáltico': 'Cimento Asfáltico',
+                    'USA B2': 'Brita 2',
+                    'USA B1': 'Brita 1',
+                    'USA Pedrisco': 'Pedrisco',
+                    'USA Pó de Pedra': 'Pó de Pedra',
+                    'Enchimento': 'Enchimento'},
+        'cores': color_fig_USA,
+        'pizzas': [('CBUQ', color_pie_cbuq, 0.48),
+                   ('Binder', color_pie_binder, 0.47)],
+        'largura': '50%'
+    },
+    'USS': {
+        'colunas': {'USS B2': 'Brita 2',
+                    'USS B1': 'Brita 1',
+                    'USS Pedrisco': 'Pedrisco',
+                    'USS Pó de Pedra': 'Pó de Pedra',
+                    'USS Cimento': 'Cimento'},
+        'cores': color_fig_USS,
+        'pizzas': [('BGS', color_pie_bgs, 0.48),
+                   ('BGMC', color_pie_bgmc, 0.46),
+                   ('BGTC', color_pie_bgtc, 0.46)],
+        'largura': '33%'
+    }
+}
+
+
+# Máximo de pontos enviados por gráfico de linha (~1 por pixel de um gráfico de 70% da
+# tela). Acima disso os dias são reduzidos aos mínimos e máximos de cada faixa
+MAX_PONTOS = int(os.environ.get('ESTOQUE_MAX_PONTOS', 800))
+
+
+def reduzir_pontos(df, colunas, max_pontos=MAX_PONTOS):
+    # Divide os dias em faixas e mantém, para cada material, o dia de menor e o de maior
+    # valor em cada uma (mais o primeiro e o último dia): picos e vales continuam visíveis.
+    # As séries compartilham o eixo x, então o total de linhas mantidas fica <= max_pontos
+    if len(df) <= max_pontos:
+        return df
+    faixas = max(1, (max_pontos - 2) // (2 * len(colunas)))
+    valores = df[colunas].reset_index(drop=True)
+    por_faixa = valores.groupby(np.arange(len(df)) * faixas // len(df))
+    posicoes = np.unique(np.concatenate([por_faixa.idxmin().to_numpy().ravel(),
+                                         por_faixa.idxmax().to_numpy().ravel(),
+                                         [0, len(df) - 1]]))
+    return df.iloc[posicoes]
+
+
+def eixo_dias(dias):
+    # Até um mês: um tick por dia, como sempre. Intervalos maiores: o Plotly escolhe
+    # o espaçamento (centenas de ticks diários travariam o navegador)
+    if not len(dias) or dias.max() - dias.min() <= pd.Timedelta(days=31):
+        return dict(tickmode='linear', dtick='D1', tickformat='%d')
+    return dict(tickformat='%d/%m/%Y')
+
+
+def textos_alerta(marcadores):
+    return [f'{material}: {cobertura:g} dias de cobertura'
+            for material, cobertura in zip(marcadores['Material'], marcadores['Cobertura'])]
+
+
+# Primeiro dia de cada alerta de cobertura (calculados em alertas.py a cada versão dos
+# dados), ao lado das observações
+def marcadores_alerta(marcadores):
+    return go.Scatter(
+        x=marcadores['Dias'],
+        y=[0] * len(marcadores),
+        mode='markers',
+        name='Alerta de estoque',
+        marker=dict(color='orange', size=10, symbol='triangle-up'),
+        hovertext=textos_alerta(marcadores)
+    )
+
+
+# Cada seção da página tem seu próprio callback: trocar a usina só recalcula USA/USS.
+# No modo cliente esses callbacks não são registrados (os do navegador os substituem)
+def callback_servidor(*args, **kwargs):
+    if MODO_CLIENTE:
+        return lambda func: func
+    return app.callback(*args, **kwargs)
+
+
+# Registra func como callback da seção, com a aba ativa como entrada extra: com outra aba
+# visível nada é calculado, e ao abrir a aba o callback roda (quase sempre do cache de
+# figuras). Nada é calculado também num worker que ainda não tem dados. Devolve func sem
+# essas verificações, para chamadas diretas (update_graph)
+def callback_secao(secao, saidas, entradas, registrar=callback_servidor):
+    def decorador(func):
+        def visivel(*valores):
+            *valores, aba = valores
+            if aba != secao or dados.snapshot_atual() is None:
+                raise PreventUpdate
+            return func(*valores)
+        registrar(saidas, [*entradas, Input('secoes-tabs', 'value')])(visivel)
+        return func
+    return decorador
+
+
+# SISTEMA PRIMÁRIO #
+
+@callback_secao(
+    'primario',
+    [Output('line1-graph', 'figure'),
+     Output('pie1-graph', 'figure')],
+    [Input('month-dropdown', 'value')]
+)
+@em_cache('primario')
+def update_primario(snapshot, selected_month):
+
+    # Um único snapshot por chamada (fixado por em_cache), mesmo que o atualizador troque
+    # os dados no meio. Fatias e totais do mês já vêm indexados do carregamento
+    etapas = metricas.Etapas('estoque_etapa_segundos', secao='primario')
+    filtered_data1 = snapshot.mes('PRIMARIO', selected_month)
+    obs1 = snapshot.obs('PRIMARIO', selected_month)
+    totais1 = snapshot.total('PRIMARIO', selected_month)
+    alertas1 = alertas.para(snapshot).marcadores_mes('PRIMARIO', selected_month)
+    etapas.marcar('filtro')
+
+    fig_line1 = px.line(reduzir_pontos(filtered_data1, ['Rocha Detonada', 'Rachão']), 
                   x='Dias', 
                   y=['Rocha Detonada', 'Rachão'],
                   labels={'value': 'Estoque (ton.)', 'variable': 'Material'},
@@ -176,40 +412,40 @@ def update_graph(selected_month, selected_unit):
                   )
     # Adicionando scatter plot para os pontos onde Obs != 0
     scatter_points = go.Scatter(
-        x=filtered_data1[filtered_data1['Obs'] != 0]['Dias'],
-        y=[0] * len(filtered_data1[filtered_data1['Obs'] != 0]),
+        x=obs1['Dias'],
+        y=[0] * len(obs1),
         mode='markers',
         name='Observação',
         marker=dict(color='red', size=10),
-        text=filtered_data1[filtered_data1['Obs'] != 0]['Obs'],
+        text=obs1['Obs'],
         textposition='top center',
-        hovertext=filtered_data1[filtered_data1['Obs'] != 0]['Obs']
+        hovertext=obs1['Obs']
     )
 
     # Atualizando o layout do gráfico
     fig_line1.add_trace(scatter_points)
+    if len(alertas1):
+        fig_line1.add_trace(marcadores_alerta(alertas1))
     fig_line1.update_layout(
         xaxis_title=f'{selected_month}',
-        xaxis=dict(
-            tickmode='linear',
-            dtick='D1',
-            tickformat='%d'
-        ),
+        xaxis=eixo_dias(filtered_data1['Dias']),
         yaxis=dict(
             range=[0,max(filtered_data1[['Rocha Detonada', 'Rachão']].max()) + 5]
         )
     )
+    etapas.marcar('figura_line1')
     
     # Calculando as porcentagens para o gráfico de pizza
-    total_producao = filtered_data1['Total Producao'].sum()
-    vendas_total = filtered_data1['Vendas'].sum()
-    obras_total = filtered_data1['Obras'].sum()
+    total_producao = totais1['Total Producao']
+    vendas_total = totais1['Vendas']
+    obras_total = totais1['Obras']
     estoque_total = total_producao - (vendas_total + obras_total)
 
     pie_data = pd.DataFrame({
         'Categoria': ['Vendas', 'Obras', 'Estoque'],
         'Quantidade': [vendas_total, obras_total, estoque_total]
     })
+    etapas.marcar('agregacao_pie1')
     
     # Gráfico de pizza
     fig_pie1 = px.pie(pie_data, values='Quantidade', names='Categoria',
@@ -217,19 +453,32 @@ def update_graph(selected_month, selected_unit):
                      labels={'Quantidade': 'Quantidade', 'Categoria': 'Categoria'},
                      color= 'Categoria',
                      color_discrete_map=color_pie1)
-    
-    # SISTEMA SECUNDÁRIO #
+    etapas.marcar('figura_pie1')
 
-    df2.rename(columns= {
-               'Estoque Mac': 'Macadame',
-               'Estoque Po': 'Pó de Pedra',
-               'Estoque Ped': 'Pedrisco',
-               'Estoque B1': 'Brita 1',
-               'Estoque B2': 'Brita 2'}, inplace= True)
+    return fig_line1, fig_pie1
 
-    filtered_data2 = df2[df2['Mês'] == selected_month]
+
+# SISTEMA SECUNDÁRIO #
+
+@callback_secao(
+    'secundario',
+    [Output('line2-graph', 'figure'),
+     Output('pie2-graph', 'figure'),
+     Output('bar1-graph', 'figure'),
+     Output('table-div', 'children')],
+    [Input('month-dropdown', 'value')]
+)
+@em_cache('secundario')
+def update_secundario(snapshot, selected_month):
+
+    etapas = metricas.Etapas('estoque_etapa_segundos', secao='secundario')
+    filtered_data2 = snapshot.mes('SECUNDARIO', selected_month)
+    obs2 = snapshot.obs('SECUNDARIO', selected_month)
+    totais2 = snapshot.total('SECUNDARIO', selected_month)
+    alertas2 = alertas.para(snapshot).marcadores_mes('SECUNDARIO', selected_month)
+    etapas.marcar('filtro')
     
-    fig_line2 = px.line(filtered_data2, 
+    fig_line2 = px.line(reduzir_pontos(filtered_data2, MATERIAIS_SECUNDARIO), 
                   x='Dias', 
                   y=['Macadame', 'Pó de Pedra', 'Pedrisco', 'Brita 1', 'Brita 2'],
                   labels={'value': 'Estoque (ton.)', 'variable': 'Material'},
@@ -238,64 +487,67 @@ def update_graph(selected_month, selected_unit):
                   )
     # Adicionando scatter plot para os pontos onde Obs != 0
     scatter_points = go.Scatter(
-        x=filtered_data2[filtered_data2['Obs'] != 0]['Dias'],
-        y=[0] * len(filtered_data2[filtered_data2['Obs'] != 0]),
+        x=obs2['Dias'],
+        y=[0] * len(obs2),
         mode='markers',
         name='Observação',
         marker=dict(color='red', size=10),
-        text=filtered_data2[filtered_data2['Obs'] != 0]['Obs'],
+        text=obs2['Obs'],
         textposition='top center',
-        hovertext=filtered_data2[filtered_data2['Obs'] != 0]['Obs']
+        hovertext=obs2['Obs']
     )
 
     # Atualizando o layout do gráfico
     fig_line2.add_trace(scatter_points)
+    if len(alertas2):
+        fig_line2.add_trace(marcadores_alerta(alertas2))
     fig_line2.update_layout(
         xaxis_title=f'{selected_month}',
-        xaxis=dict(
-            tickmode='linear',
-            dtick='D1',
-            tickformat='%d'
-        ),
+        xaxis=eixo_dias(filtered_data2['Dias']),
         yaxis=dict(
             range=[0, max(filtered_data2[['Macadame', 'Pó de Pedra', 'Pedrisco', 'Brita 1', 'Brita 2']].max()) + 5]
         )
     )
+    etapas.marcar('figura_line2')
 
-    macadame = filtered_data2['Macadame'].sum()
-    podepedra = filtered_data2['Pó de Pedra'].sum()
-    pedrisco = filtered_data2['Pedrisco'].sum()
-    brita1 = filtered_data2['Brita 1'].sum()
-    brita2 = filtered_data2['Brita 2'].sum()
+    macadame = totais2['Macadame']
+    podepedra = totais2['Pó de Pedra']
+    pedrisco = totais2['Pedrisco']
+    brita1 = totais2['Brita 1']
+    brita2 = totais2['Brita 2']
 
     pie2_data = pd.DataFrame({
         'Materiais': ['Macadame', 'Pó de Pedra', 'Pedrisco', 'Brita 1', 'Brita 2'],
         'Quantidades': [macadame, podepedra, pedrisco, brita1, brita2]
     })
+    etapas.marcar('agregacao_pie2')
 
     fig_pie2 = px.pie(pie2_data, values='Quantidades', names='Materiais',
                      title=f'Distribuição de Materiais no Estoque - {selected_month}',
                      labels={'Quantidade': 'Quantidade', 'Materiais': 'Materiais'},
                      color= 'Materiais',
                      color_discrete_map= color_pie2)
+    etapas.marcar('figura_pie2')
 
     # Gráfico de barras
     bar1_data = {
         'Material': ['Macadame', 'Macadame', 'Pó de Pedra', 'Pó de Pedra', 'Pedrisco', 'Pedrisco', 'Brita 1', 'Brita 1', 'Brita 2', 'Brita 2'],
         'Categoria': ['Vendas', 'Obras', 'Vendas', 'Obras', 'Vendas', 'Obras', 'Vendas', 'Obras', 'Vendas', 'Obras'],
         'Quantidade': [
-            filtered_data2['Venda Mac'].sum(), filtered_data2['Obras Mac'].sum(),
-            filtered_data2['Venda Po'].sum(), filtered_data2['Obras Po'].sum(),
-            filtered_data2['Venda Ped'].sum(), filtered_data2['Obras Ped'].sum(),
-            filtered_data2['Venda B1'].sum(), filtered_data2['Obras B1'].sum(),
-            filtered_data2['Venda B2'].sum(), filtered_data2['Obras B2'].sum()
+            totais2['Venda Mac'], totais2['Obras Mac'],
+            totais2['Venda Po'], totais2['Obras Po'],
+            totais2['Venda Ped'], totais2['Obras Ped'],
+            totais2['Venda B1'], totais2['Obras B1'],
+            totais2['Venda B2'], totais2['Obras B2']
         ]
     }
     bar1_df = pd.DataFrame(bar1_data)
+    etapas.marcar('agregacao_bar1')
     bar1_fig = px.bar(bar1_df, x='Material', y='Quantidade', color='Categoria', barmode='group',
                      title=f'Saídas Totais de Materiais - {selected_month}',
                      labels={'Quantidade': 'Quantidade (ton.)'},
                      color_discrete_map=color_bar1)
+    etapas.marcar('figura_bar1')
 
     # Tabela
     table = html.Table([
@@ -303,203 +555,345 @@ def update_graph(selected_month, selected_unit):
             html.Tr([html.Th("Material"), html.Th("Vendas (ton.)"), html.Th("Obras (ton.)")])
         ),
         html.Tbody([
-            html.Tr([html.Td("Macadame"), html.Td(filtered_data2['Venda Mac'].sum()), html.Td(filtered_data2['Obras Mac'].sum())]),
-            html.Tr([html.Td("Pó de Pedra"), html.Td(filtered_data2['Venda Po'].sum()), html.Td(filtered_data2['Obras Po'].sum())]),
-            html.Tr([html.Td("Pedrisco"), html.Td(filtered_data2['Venda Ped'].sum()), html.Td(filtered_data2['Obras Ped'].sum())]),
-            html.Tr([html.Td("Brita 1"), html.Td(filtered_data2['Venda B1'].sum()), html.Td(filtered_data2['Obras B1'].sum())]),
-            html.Tr([html.Td("Brita 2"), html.Td(filtered_data2['Venda B2'].sum()), html.Td(filtered_data2['Obras B2'].sum())])
+            html.Tr([html.Td("Macadame"), html.Td(totais2['Venda Mac']), html.Td(totais2['Obras Mac'])]),
+            html.Tr([html.Td("Pó de Pedra"), html.Td(totais2['Venda Po']), html.Td(totais2['Obras Po'])]),
+            html.Tr([html.Td("Pedrisco"), html.Td(totais2['Venda Ped']), html.Td(totais2['Obras Ped'])]),
+            html.Tr([html.Td("Brita 1"), html.Td(totais2['Venda B1']), html.Td(totais2['Obras B1'])]),
+            html.Tr([html.Td("Brita 2"), html.Td(totais2['Venda B2']), html.Td(totais2['Obras B2'])])
         ])
-    ], style={'border': '2px solid black', 'border-collapse': 'collapse', 'width': '100%', 'text-align': 'center'})
-
-    # Adicionando bordas às células da tabela
-    for elem in table.children:
-        for row in elem.children:
-            for cell in row.children:
-                cell.style = {'border': '1px solid black', 'padding': '8px'}
-
-    # USA & USS #
-
-    # Filtrando df_usauss por mês selecionado
-    filtered_df_usauss = df_usauss[df_usauss['Mês'] == selected_month]
-
-    # Separando dados da USA e USS
-    df_usa = filtered_df_usauss.drop(columns={'BGS', 'Vendas BGS', 'Obras BGS', 
-                                              'BGMC', 'Vendas BGMC', 'Obras BGMC', 
-                                              'BGTC', 'Vendas BGTC', 'Obras BGTC',
-                                              'USS Cimento', 'USS B2', 'USS B1', 'USS Pedrisco', 'USS Pó de Pedra'
-                                              })
-    df_usa.rename(columns={'USA B2': 'Brita 2',
-                           'USA B1': 'Brita 1',
-                           'USA Pedrisco': 'Pedrisco',
-                           'USA Pó de Pedra': 'Pó de Pedra'}, inplace=True)
-
-    df_uss = filtered_df_usauss.drop(columns={'USA B2', 'USA B1', 'USA Pedrisco', 'USA Pó de Pedra', 'Enchimento',
-                                              'CBUQ', 'Vendas CBUQ', 'Obras CBUQ', 
-                                              'Binder', 'Vendas Binder', 'Obras Binder',
-                                              'Cimento Asfáltico'})
-    df_uss.rename(columns={'USS B2': 'Brita 2',
-                           'USS B1': 'Brita 1',
-                           'USS Pedrisco': 'Pedrisco',
-                           'USS Pó de Pedra': 'Pó de Pedra',
-                           'USS Cimento': 'Cimento'}, inplace=True)
-
-    # DataFrames para USA pie
-    usa_cbuq_pie = df_usa[['Vendas CBUQ', 'Obras CBUQ']].sum().reset_index()
-    usa_cbuq_pie.columns = ['Categoria', 'Quantidade']
-
-    usa_binder_pie = df_usa[['Vendas Binder', 'Obras Binder']].sum().reset_index()
-    usa_binder_pie.columns = ['Categoria', 'Quantidade']
-
-    # DataFrames para USS pie
-    uss_bgs_pie = df_uss[['Vendas BGS', 'Obras BGS']].sum().reset_index()
-    uss_bgs_pie.columns = ['Categoria', 'Quantidade']
-
-    uss_bgmc_pie = df_uss[['Vendas BGMC', 'Obras BGMC']].sum().reset_index()
-    uss_bgmc_pie.columns = ['Categoria', 'Quantidade']
-  
-    uss_bgtc_pie = df_uss[['Vendas BGTC', 'Obras BGTC']].sum().reset_index()
-    uss_bgtc_pie.columns = ['Categoria', 'Quantidade']
-
-    # Gráficos pie para USA
-    fig_usa_cbuq_pie = px.pie(usa_cbuq_pie, values='Quantidade', names='Categoria',
-                              title='Distribuição de CBUQ - USA',
-                              color= 'Categoria',
-                              color_discrete_map=color_pie_cbuq)
-
-    fig_usa_binder_pie = px.pie(usa_binder_pie, values='Quantidade', names='Categoria',
-                                title='Distribuição de Binder - USA',
-                                color= 'Categoria',
-                                color_discrete_map=color_pie_binder)
-
-    # Gráficos pie para USS
-    fig_uss_bgs_pie = px.pie(uss_bgs_pie, values='Quantidade', names='Categoria',
-                             title='Distribuição de BGS - USS',
-                             color= 'Categoria',
-                             color_discrete_map=color_pie_bgs)
-
-    fig_uss_bgmc_pie = px.pie(uss_bgmc_pie, values='Quantidade', names='Categoria',
-                              title='Distribuição de BGMC - USS',
-                              color= 'Categoria',
-                              color_discrete_map=color_pie_bgmc)
-
-    fig_uss_bgtc_pie = px.pie(uss_bgtc_pie, values='Quantidade', names='Categoria',
-                              title='Distribuição de BGTC - USS',
-                              color= 'Categoria',
-                              color_discrete_map=color_pie_bgtc)
-
-
-    # Configurando fig_USAUSS com base na unidade selecionada
-    if selected_unit == 'USA':
-        fig_USAUSS = px.line(df_usa,
-                            x='Dias', 
-                            y=['Cimento Asfáltico', 'Brita 2', 'Brita 1', 'Pedrisco', 'Pó de Pedra', 'Enchimento'],
-                            labels={'value': 'Quantidade (ton.)', 'variable': 'Material'},
-                            title=f'Entrada de Materiais USA - {selected_month}',
-                            color_discrete_map=color_fig_USA
-                            )
-        # Adicionando scatter plot para os pontos onde Obs != 0
-        scatter_points = go.Scatter(
-            x=df_usa[df_usa['Obs'] != 0]['Dias'],
-            y=[0] * len(df_usa[df_usa['Obs'] != 0]),
-            mode='markers',
-            name='Observação',
-            marker=dict(color='red', size=10),
-            text=df_usa[df_usa['Obs'] != 0]['Obs'],
-            textposition='top center',
-            hovertext=df_usa[df_usa['Obs'] != 0]['Obs']
-        )
+    ], className='tabela-estoque')  # bordas e espaçamento em assets/estilo.css
+    etapas.marcar('tabela')
 
-        # Atualizando o layout do gráfico
-        fig_USAUSS.add_trace(scatter_points)
-        fig_USAUSS.update_layout(
-            xaxis_title=f'{selected_month}',
-            xaxis=dict(
-                tickmode='linear',
-                dtick='D1',
-                tickformat='%d'
-            ),
-            yaxis=dict(
-                range=[0, max(df_usa[['Pó de Pedra', 'Pedrisco', 'Brita 1', 'Brita 2']].max()) + 5]
-            )
-        )
+    return fig_line2, fig_pie2, bar1_fig, table
 
-        pie_graphs = html.Div([
-            dcc.Graph(figure=fig_usa_cbuq_pie, 
-                      style={'width': '50%', 'display': 'inline-block'}
-                      ),
-            dcc.Graph(figure=fig_usa_binder_pie, 
-                      style={'width': '50%', 'display': 'inline-block'}
-                      )
-        ])
-        fig_usa_cbuq_pie.update_traces(labels=['Vendas', 'Consumo'])
-        fig_usa_cbuq_pie.update_layout(title_x= 0.48)
-        fig_usa_binder_pie.update_traces(labels=['Vendas', 'Consumo'])
-        fig_usa_binder_pie.update_layout(title_x= 0.47)
-
-    else:
-        fig_USAUSS = px.line(df_uss,
-                            x='Dias', 
-                            y=['Brita 2', 'Brita 1', 'Pedrisco', 'Pó de Pedra', 'Cimento'],
-                            labels={'value': 'Quantidade (ton.)', 'variable': 'Material'},
-                            title=f'Entrada de Materiais USS - {selected_month}',
-                            color_discrete_map=color_fig_USS
-                            )
-        # Adicionando scatter plot para os pontos onde Obs != 0
-        scatter_points = go.Scatter(
-            x=df_uss[df_uss['Obs'] != 0]['Dias'],
-            y=[0] * len(df_uss[df_uss['Obs'] != 0]),
-            mode='markers',
-            name='Observação',
-            marker=dict(color='red', size=10),
-            text=df_uss[df_uss['Obs'] != 0]['Obs'],
-            textposition='top center',
-            hovertext=df_uss[df_uss['Obs'] != 0]['Obs']
-        )
 
-        # Atualizando o layout do gráfico
-        fig_USAUSS.add_trace(scatter_points)
-        fig_USAUSS.update_layout(
-            xaxis_title=f'{selected_month}',
-            xaxis=dict(
-                tickmode='linear',
-                dtick='D1',
-                tickformat='%d'
-            ),
-            yaxis=dict(
-                range=[0, max(df_uss[['Pó de Pedra', 'Pedrisco', 'Brita 1', 'Brita 2']].max()) + 5]
-            )
-        )
-        pie_graphs = html.Div([
-            dcc.Graph(figure=fig_uss_bgs_pie, 
-                      style={'width': '33%', 'display': 'inline-block'}
-                      ),
-            dcc.Graph(figure=fig_uss_bgmc_pie, 
-                      style={'width': '33%', 'display': 'inline-block'}
-                      ),
-            dcc.Graph(figure=fig_uss_bgtc_pie, 
-                      style={'width': '33%', 'display': 'inline-block'}
-                      )
-        ])
-        fig_uss_bgs_pie.update_traces(labels=['Vendas', 'Consumo'])
-        fig_uss_bgs_pie.update_layout(title_x= 0.48)
-        fig_uss_bgmc_pie.update_traces(labels=['Vendas', 'Consumo'])
-        fig_uss_bgmc_pie.update_layout(title_x= 0.46)
-        fig_uss_bgtc_pie.update_traces(labels=['Vendas', 'Consumo'])
-        fig_uss_bgtc_pie.update_layout(title_x= 0.46)
+# USA & USS #
+
+@callback_secao(
+    'usa-uss',
+    [Output('usa-uss-graph', 'figure'),
+     Output('usa-uss-pie-graphs', 'children')],
+    [Input('month-dropdown', 'value'),
+     Input('unit-dropdown', 'value')]
+)
+@em_cache('usa-uss')
+def update_usa_uss(snapshot, selected_month, selected_unit):
+
+    usina = USINAS[selected_unit]
+
+    # Separando os dados da usina selecionada no mês selecionado
+    etapas = metricas.Etapas('estoque_etapa_segundos', secao='usa-uss')
+    filtered_df_usauss = snapshot.mes('USA&USS', selected_month)
+    obs_usauss = snapshot.obs('USA&USS', selected_month)
+    totais_usauss = snapshot.total('USA&USS', selected_month)
+    df_usina = filtered_df_usauss[['Dias', *usina['colunas']]].rename(columns=usina['colunas'])
+    etapas.marcar('filtro')
+
+    fig_USAUSS = px.line(reduzir_pontos(df_usina, list(usina['colunas'].values())),
+                        x='Dias', 
+                        y=list(usina['colunas'].values()),
+                        labels={'value': 'Quantidade (ton.)', 'variable': 'Material'},
+                        title=f'Entrada de Materiais {selected_unit} - {selected_month}',
+                        color_discrete_map=usina['cores']
+                        )
+    # Adicionando scatter plot para os pontos onde Obs != 0
+    scatter_points = go.Scatter(
+        x=obs_usauss['Dias'],
+        y=[0] * len(obs_usauss),
+        mode='markers',
+        name='Observação',
+        marker=dict(color='red', size=10),
+        text=obs_usauss['Obs'],
+        textposition='top center',
+        hovertext=obs_usauss['Obs']
+    )
 
+    # Atualizando o layout do gráfico
+    fig_USAUSS.add_trace(scatter_points)
     fig_USAUSS.update_layout(
         xaxis_title=f'{selected_month}',
-        xaxis=dict(
-            tickmode='linear',
-            dtick='D1',
-            tickformat='%d'
+        xaxis=eixo_dias(df_usina['Dias']),
+        yaxis=dict(
+            range=[0, max(df_usina[['Pó de Pedra', 'Pedrisco', 'Brita 1', 'Brita 2']].max()) + 5]
+        )
+    )
+    etapas.marcar('figura_usina')
+
+    # Gráficos pie da usina (só os da usina selecionada)
+    pies = []
+    for produto, cores, title_x in usina['pizzas']:
+        pie_df = totais_usauss[[f'Vendas {produto}', f'Obras {produto}']].reset_index()
+        pie_df.columns = ['Categoria', 'Quantidade']
+        fig_pie = px.pie(pie_df, values='Quantidade', names='Categoria',
+                         title=f'Distribuição de {produto} - {selected_unit}',
+                         color= 'Categoria',
+                         color_discrete_map=cores)
+        fig_pie.update_traces(labels=['Vendas', 'Consumo'])
+        fig_pie.update_layout(title_x= title_x)
+        pies.append(dcc.Graph(figure=fig_pie, 
+                              style={'width': usina['largura'], 'display': 'inline-block'}
+                              ))
+    pie_graphs = html.Div(pies)
+    etapas.marcar('figura_pizzas')
+
+    return fig_USAUSS, pie_graphs
+
+
+# COMPARAÇÃO ENTRE PERÍODOS #
+
+# Meses do intervalo inicial, terminando no último dia com lançamentos (e não no fim do
+# ano, até onde a planilha já traz as linhas zeradas)
+PERIODO_PADRAO = 6
+
+
+def periodo_recente(snapshot, meses):
+    fim = snapshot.ultimo_movimento()
+    return fim - pd.DateOffset(months=meses) + pd.Timedelta(days=1), fim
+
+
+@app.callback(
+    [Output('periodo-range', 'start_date'),
+     Output('periodo-range', 'end_date')],
+    [Input('periodo-atalho', 'value')]
+)
+def update_periodo(meses):
+    snapshot = dados.snapshot_atual()
+    if snapshot is None:
+        raise PreventUpdate
+    inicio, fim = periodo_recente(snapshot, meses)
+    return inicio.date(), fim.date()
+
+
+def barras_com_variacao(tabela, cores, titulo, rotulo_x, tickformat):
+    # Uma série de barras por coluna, com a variação em relação ao período anterior no hover
+    anterior = tabela.shift()
+    variacao = ((tabela - anterior) / anterior).where(anterior.notna() & (anterior != 0))
+    fig = go.Figure(layout=dict(template=TEMPLATE_LEVE))
+    for coluna in tabela.columns:
+        fig.add_trace(go.Bar(
+            x=tabela.index,
+            y=tabela[coluna],
+            name=coluna,
+            marker_color=cores[coluna],
+            customdata=[f'{v:+.1%}' if pd.notna(v) else '-' for v in variacao[coluna]],
+            hovertemplate=f'{coluna}<br>%{{x|{tickformat}}}: %{{y:.2f}} ton.'
+                          '<br>Variação: %{customdata}<extra></extra>'
         ))
-    
+    fig.update_layout(title=titulo, barmode='group', xaxis_title=rotulo_x,
+                      yaxis_title='Quantidade (ton.)', legend_title='Material',
+                      xaxis=dict(tickformat=tickformat))
+    return fig
+
+
+# Usa os agregados semanais/mensais do snapshot e, no gráfico diário, no máximo MAX_PONTOS
+# dias: o custo quase não cresce com o tamanho do intervalo. Fica no servidor também no
+# modo cliente (o Store só leva dados por mês)
+@callback_secao(
+    'comparacao',
+    [Output('comparacao-diario-graph', 'figure'),
+     Output('comparacao-estoque-graph', 'figure'),
+     Output('comparacao-saidas-graph', 'figure'),
+     Output('comparacao-usinas-graph', 'figure')],
+    [Input('periodo-range', 'start_date'),
+     Input('periodo-range', 'end_date'),
+     Input('granularidade-radio', 'value')],
+    registrar=app.callback
+)
+@em_cache('comparacao')
+def update_comparacao(snapshot, start_date, end_date, granularidade):
+
+    rotulo_x = 'Mês' if granularidade == 'mes' else 'Semana (início)'
+    tickformat = '%m/%Y' if granularidade == 'mes' else '%d/%m/%Y'
+
+    # Estoque diário do primário no intervalo
+    etapas = metricas.Etapas('estoque_etapa_segundos', secao='comparacao')
+    linhas1, obs1 = snapshot.intervalo('PRIMARIO', start_date, end_date)
+    alertas1 = alertas.para(snapshot).marcadores('PRIMARIO', start_date, end_date)
+    etapas.marcar('filtro')
+    fig_diario = px.line(reduzir_pontos(linhas1, ['Rocha Detonada', 'Rachão']),
+                         x='Dias',
+                         y=['Rocha Detonada', 'Rachão'],
+                         labels={'value': 'Estoque (ton.)', 'variable': 'Material'},
+                         title='Estoque Diário',
+                         color_discrete_map=color_line1)
+    # As observações não passam pela redução: todas aparecem, no dia exato
+    fig_diario.add_trace(go.Scatter(
+        x=obs1['Dias'],
+        y=[0] * len(obs1),
+        mode='markers',
+        name='Observação',
+        marker=dict(color='red', size=10),
+        text=obs1['Obs'],
+        textposition='top center',
+        hovertext=obs1['Obs']
+    ))
+    if len(alertas1):
+        fig_diario.add_trace(marcadores_alerta(alertas1))
+    fig_diario.update_layout(xaxis=eixo_dias(linhas1['Dias']))
+    etapas.marcar('figura_diario')
+
+    # Estoque do primário no fim de cada período
+    _, fim1 = snapshot.periodos('PRIMARIO', granularidade, start_date, end_date)
+    fig_estoque = px.line(fim1.reset_index(),
+                          x='Dias',
+                          y=['Rocha Detonada', 'Rachão'],
+                          labels={'value': 'Estoque (ton.)', 'variable': 'Material', 'Dias': rotulo_x},
+                          title=f'Estoque no Fim de Cada {rotulo_x.split()[0]}',
+                          color_discrete_map=color_line1,
+                          markers=True)
+    fig_estoque.update_layout(xaxis=dict(tickformat=tickformat))
+    etapas.marcar('figura_estoque')
+
+    # Saídas (vendas + obras) de cada material do secundário
+    soma2, _ = snapshot.periodos('SECUNDARIO', granularidade, start_date, end_date)
+    saidas = pd.DataFrame({
+        material: soma2[f'Venda {sigla}'] + soma2[f'Obras {sigla}']
+        for material, sigla in zip(MATERIAIS_SECUNDARIO, ['Mac', 'Po', 'Ped', 'B1', 'B2'])
+    }).round(2)
+    etapas.marcar('agregacao_saidas')
+    fig_saidas = barras_com_variacao(saidas, color_line2, 'Saídas de Materiais (Vendas + Obras)',
+                                     rotulo_x, tickformat)
+    etapas.marcar('figura_saidas')
+
+    # Entrada total de materiais em cada usina
+    soma_usauss, _ = snapshot.periodos('USA&USS', granularidade, start_date, end_date)
+    entradas = pd.DataFrame({
+        unidade: soma_usauss[list(usina['colunas'])].sum(axis=1)
+        for unidade, usina in USINAS.items()
+    }).round(2)
+    etapas.marcar('agregacao_usinas')
+    fig_usinas = barras_com_variacao(entradas, color_usinas, 'Entrada de Materiais nas Usinas',
+                                     rotulo_x, tickformat)
+    etapas.marcar('figura_usinas')
+
+    return fig_diario, fig_estoque, fig_saidas, fig_usinas
+
+
+# Página inteira de uma vez (usado fora do Dash, p.ex. em scripts)
+def update_graph(selected_month, selected_unit):
+    return (*update_primario(selected_month),
+            *update_secundario(selected_month),
+            *update_usa_uss(selected_month, selected_unit))
+
+
+# Pré-calcula as figuras dos últimos meses com dados e do mês inicial do dropdown (os
+# mais acessados) para as duas usinas, a cada troca de snapshot (na thread do
+# atualizador, fora da partida)
+AQUECER_MESES = int(os.environ.get('ESTOQUE_CACHE_AQUECER_MESES', 1))
+
+@dados.ao_atualizar
+def aquecer_cache(snapshot=None, meses=AQUECER_MESES):
+    if meses <= 0 or MODO_CLIENTE:
+        return
+    snapshot = snapshot or dados.snapshot_atual()
+    # A planilha já traz as linhas do resto do ano: os últimos meses são os que terminam
+    # no último dia com lançamentos, e não os últimos da planilha, que ainda estão zerados.
+    # Mais o mês que a página abre selecionado (o primeiro do dropdown)
+    todos = list(snapshot.meses['PRIMARIO'])
+    ultimo = f'{snapshot.ultimo_movimento():%Y-%m}'
+    recentes = [mes for mes in todos if mes <= ultimo][-meses:]
+    for mes in dict.fromkeys([*todos[:1], *recentes]):
+        for unidade in USINAS:
+            update_graph(mes, unidade)
+
+# MODO CLIENTE #
+
+# Colunas diárias (gráficos de linha) e totais do mês (pizzas, barras e tabela)
+# que o navegador precisa de cada aba
+COLUNAS_CLIENTE = {
+    'PRIMARIO': (['Rocha Detonada', 'Rachão'],
+                 ['Total Producao', 'Vendas', 'Obras']),
+    'SECUNDARIO': (MATERIAIS_SECUNDARIO,
+                   [*MATERIAIS_SECUNDARIO,
+                    *[f'{tipo} {sigla}' for sigla in ['Mac', 'Po', 'Ped', 'B1', 'B2'] for tipo in ['Venda', 'Obras']]]),
+    'USA&USS': ([coluna for usina in USINAS.values() for coluna in usina['colunas']],
+                [f'{tipo} {produto}' for usina in USINAS.values() for produto, _, _ in usina['pizzas']
+                 for tipo in ['Vendas', 'Obras']]),
+}
+
+_dados_cliente = (None, None)
+
+
+# Dados compactos por mês (valores arredondados, só as colunas usadas), montados uma
+# vez por versão dos dados
+def dados_cliente(snapshot):
+    global _dados_cliente
+    versao, compactos = _dados_cliente
+    if versao == snapshot.versao:
+        return compactos
+
+    compactos = {
+        'config': {
+            'cores': {'line1': color_line1, 'pie1': color_pie1, 'line2': color_line2,
+                      'pie2': color_pie2, 'bar1': color_bar1},
+            'usinas': USINAS
+        }
+    }
+    alertas_versao = alertas.para(snapshot)
+    for aba, (diarias, mensais) in COLUNAS_CLIENTE.items():
+        totais = snapshot.totais[aba][mensais].round(2)
+        compactos[aba] = {}
+        for mes in snapshot.meses[aba]:
+            fatia = snapshot.mes(aba, mes)
+            obs = snapshot.obs(aba, mes)
+            marcadores = alertas_versao.marcadores_mes(aba, mes)
+            compactos[aba][mes] = {
+                'Dias': fatia['Dias'].dt.strftime('%Y-%m-%d').tolist(),
+                **{coluna: fatia[coluna].round(2).tolist() for coluna in diarias},
+                'obs': {'Dias': obs['Dias'].dt.strftime('%Y-%m-%d').tolist(),
+                        'Obs': obs['Obs'].astype(str).tolist()},
+                'alertas': {'Dias': marcadores['Dias'].dt.strftime('%Y-%m-%d').tolist(),
+                            'Texto': textos_alerta(marcadores)},
+                'totais': totais.loc[mes].to_dict()
+            }
+
+    _dados_cliente = (snapshot.versao, compactos)
+    return compactos
+
+
+if MODO_CLIENTE:
+    app.clientside_callback(
+        ClientsideFunction(namespace='estoque', function_name='primario'),
+        [Output('line1-graph', 'figure'),
+         Output('pie1-graph', 'figure')],
+        [Input('month-dropdown', 'value'),
+         Input('dados-estoque', 'data')]
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace='estoque', function_name='secundario'),
+        [Output('line2-graph', 'figure'),
+         Output('pie2-graph', 'figure'),
+         Output('bar1-graph', 'figure'),
+         Output('table-div', 'children')],
+        [Input('month-dropdown', 'value'),
+         Input('dados-estoque', 'data')]
+    )
+    app.clientside_callback(
+        ClientsideFunction(namespace='estoque', function_name='usa_uss'),
+        [Output('usa-uss-graph', 'figure'),
+         Output('usa-uss-pie-graphs', 'children')],
+        [Input('month-dropdown', 'value'),
+         Input('unit-dropdown', 'value'),
+         Input('dados-estoque', 'data')]
+    )
+
+app.layout = layout
 
-    return fig_line1, fig_pie1, fig_line2, fig_pie2, bar1_fig, table, fig_USAUSS, pie_graphs
+# Tempo de importação do app, até aqui sem dados nem pandas: acima do orçamento, a
+# partida (e a abertura da porta) ficou lenta
+ORCAMENTO_IMPORTACAO = float(os.environ.get('ESTOQUE_ORCAMENTO_IMPORTACAO', 2))
+TEMPO_IMPORTACAO = time.perf_counter() - _inicio_importacao
+if TEMPO_IMPORTACAO > ORCAMENTO_IMPORTACAO:
+    log.warning('App importado em %.2f s, acima do orçamento de %.2f s',
+                TEMPO_IMPORTACAO, ORCAMENTO_IMPORTACAO)
+else:
+    log.info('App importado em %.2f s (orçamento %.2f s)', TEMPO_IMPORTACAO, ORCAMENTO_IMPORTACAO)
 
 # Rodando o aplicativo
 if __name__ == '__main__':
+    logging.basicConfig(level=os.environ.get('ESTOQUE_LOG', 'INFO'))
+    dados.iniciar_atualizador()
     port = int(os.environ.get('PORT', 8050))
-    app.run_server(debug=True, host='0.0.0.0', port=port)
+    debug = os.environ.get('ESTOQUE_DEBUG', '0') == '1'
+    app.run_server(debug=debug, host='0.0.0.0', port=port)
     
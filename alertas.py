@@ -0,0 +1,245 @@
+import logging
+import math
+import os
+import threading
+from dataclasses import dataclass, field
+
+import flask
+
+import dados
+import metricas
+from importacao import tardia
+
+np = tardia('numpy')
+pd = tardia('pandas')
+
+log = logging.getLogger('estoque.alertas')
+
+# Alertas de estoque e previsão, calculados uma vez por versão dos dados (na thread do
+# atualizador), e não a cada callback:
+#
+#   consumo diário   média móvel de Vendas + Obras nos últimos JANELA dias
+#   cobertura        dias que o estoque atual dura com esse consumo (zero sem estoque)
+#   alerta           cobertura abaixo de LIMITE_DIAS
+#   previsão         estoque em HORIZONTE dias pela tendência (variação média diária do
+#                    saldo na janela), data prevista para zerar e consumo no horizonte
+#
+# Os gráficos marcam o primeiro dia de cada alerta, ao lado das observações, e
+# /api/alertas traz a situação de cada material no último dia com dados
+
+# Dias da média móvel do consumo (uma linha da planilha por dia)
+JANELA = int(os.environ.get('ESTOQUE_ALERTA_JANELA', 30))
+# Cobertura mínima (dias) antes do alerta
+LIMITE_DIAS = float(os.environ.get('ESTOQUE_ALERTA_DIAS', 7))
+# Horizonte (dias) da previsão
+HORIZONTE = int(os.environ.get('ESTOQUE_PREVISAO_DIAS', 30))
+
+# Por aba, cada material: (coluna de estoque, colunas de saída). Os produtos das usinas
+# não têm saldo na planilha: só consumo e previsão de consumo, sem cobertura nem alerta.
+# Na Rocha Detonada, Vendas + Obras é quase só Obras RD (a planilha não tem vendas nem
+# produção de RD lançadas), então sua cobertura pelo consumo diz pouco: na prática o
+# alerta dela vem do saldo zerado ou negativo
+MATERIAIS = {
+    'PRIMARIO': {
+        'Rocha Detonada': ('Rocha Detonada', ['Venda RD', 'Obras RD']),
+        'Rachão': ('Rachão', ['Venda Rachão', 'Obras Rachão']),
+    },
+    'SECUNDARIO': {
+        material: (material, [f'Venda {sigla}', f'Obras {sigla}'])
+        for material, sigla in [('Macadame', 'Mac'), ('Pó de Pedra', 'Po'), ('Pedrisco', 'Ped'),
+                                ('Brita 1', 'B1'), ('Brita 2', 'B2')]
+    },
+    'USA&USS': {
+        produto: (None, [f'Vendas {produto}', f'Obras {produto}'])
+        for produto in ['CBUQ', 'Binder', 'BGS', 'BGMC', 'BGTC']
+    },
+}
+
+rotas = flask.Blueprint('alertas', __name__)
+
+
+def _series(df, materiais, anterior=None, inicio=0):
+    # {'consumo', 'cobertura'} de cada dia, uma coluna por material. Com as séries da versão
+    # anterior, reaproveita as inicio primeiras linhas (as que não mudaram na planilha) e
+    # recalcula só as seguintes, a partir de JANELA - 1 dias antes para completar a média
+    if anterior is None:
+        inicio = 0
+    corte = max(inicio - JANELA + 1, 0)
+    trecho = df.iloc[corte:]
+    saidas = pd.DataFrame({material: trecho[colunas].sum(axis=1)
+                           for material, (_, colunas) in materiais.items()}, dtype='float64')
+    consumo = saidas.rolling(JANELA, min_periods=1).mean().iloc[inicio - corte:]
+
+    estoques = pd.DataFrame({material: trecho[coluna]
+                             for material, (coluna, _) in materiais.items() if coluna},
+                            index=trecho.index, dtype='float64').iloc[inicio - corte:]
+    # Sem estoque (saldo <= 0) a cobertura é zero, com ou sem consumo; com estoque e sem
+    # consumo, é infinita (NaN: não alerta)
+    consumo_estoques = consumo[estoques.columns]
+    cobertura = estoques.div(consumo_estoques.where(consumo_estoques > 0)).mask(estoques <= 0, 0.0)
+
+    if inicio:
+        consumo = pd.concat([anterior['consumo'].iloc[:inicio], consumo])
+        cobertura = pd.concat([anterior['cobertura'].iloc[:inicio], cobertura])
+    return {'consumo': consumo, 'cobertura': cobertura}
+
+
+def _resumo(aba, df, materiais, series, p):
+    # Situação e previsão de cada material no dia da posição p
+    if p is None:
+        return []
+    base = max(p - JANELA, 0)
+    dia = df['Dias'].iloc[p]
+    linhas = []
+    for material, (coluna, _) in materiais.items():
+        consumo = float(series['consumo'][material].iloc[p])
+        linha = {
+            'Aba': aba, 'Material': material, 'Dia': dia,
+            'Consumo diário (ton.)': round(consumo, dados.CASAS_DECIMAIS),
+            'Consumo previsto (ton.)': round(consumo * HORIZONTE, dados.CASAS_DECIMAIS),
+            'Estoque (ton.)': None, 'Cobertura (dias)': None, 'Alerta': None,
+            'Tendência diária (ton.)': None, 'Estoque previsto (ton.)': None, 'Ruptura prevista': None,
+        }
+        if coluna:
+            estoque = float(df[coluna].iloc[p])
+            cobertura = series['cobertura'][material].iloc[p]
+            tendencia = (estoque - float(df[coluna].iloc[base])) / (p - base) if p > base else 0.0
+            if estoque <= 0:
+                ruptura = dia
+            elif tendencia < 0:
+                ruptura = dia + pd.Timedelta(days=math.ceil(estoque / -tendencia))
+            else:
+                ruptura = None
+            linha.update({
+                'Estoque (ton.)': round(estoque, dados.CASAS_DECIMAIS),
+                'Cobertura (dias)': None if pd.isna(cobertura) else round(float(cobertura), 1),
+                'Alerta': bool(cobertura < LIMITE_DIAS),
+                'Tendência diária (ton.)': round(tendencia, dados.CASAS_DECIMAIS),
+                'Estoque previsto (ton.)': round(estoque + tendencia * HORIZONTE, dados.CASAS_DECIMAIS),
+                'Ruptura prevista': ruptura,
+            })
+        linhas.append(linha)
+    return linhas
+
+
+# Séries, alertas e resumo de uma versão dos dados. ultimo_dia = {aba: último dia com
+# movimento}, até onde há alertas; assinaturas (as do snapshot) servem para achar, na
+# versão seguinte, as linhas que não mudaram
+@dataclass(frozen=True)
+class Alertas:
+    versao: str
+    ultimo_dia: dict
+    assinaturas: dict = field(repr=False)
+    dias: dict = field(repr=False)
+    series: dict = field(repr=False)
+    resumo: list = field(repr=False)
+
+    def marcadores(self, aba, inicio, fim):
+        # Primeiro dia de cada alerta entre inicio e fim (um alerta que já vinha de antes
+        # aparece no primeiro dia): Dias, Material, Cobertura
+        dias = self.dias[aba]
+        fim = min(pd.Timestamp(fim), self.ultimo_dia.get(aba) or pd.Timestamp.min)
+        dentro = (dias >= pd.Timestamp(inicio)) & (dias <= fim)
+        cobertura = self.series[aba]['cobertura'][dentro.to_numpy()]
+        alerta = (cobertura < LIMITE_DIAS).to_numpy(dtype=bool)
+        comeco = alerta & ~np.vstack([np.zeros((1, alerta.shape[1]), bool), alerta[:-1]])
+        linhas, colunas = np.nonzero(comeco)
+        marcadores = pd.DataFrame({
+            'Dias': dias[dentro].to_numpy()[linhas],
+            'Material': cobertura.columns[colunas],
+            'Cobertura': cobertura.to_numpy()[linhas, colunas].round(1),
+        })
+        return marcadores.sort_values('Dias', kind='stable').reset_index(drop=True)
+
+    def marcadores_mes(self, aba, mes):
+        # Sem mês (dropdown limpo) ou com um inválido, nenhum marcador, como em snapshot.mes
+        try:
+            inicio = pd.Timestamp(f'{mes}-01')
+        except ValueError:
+            inicio = pd.NaT
+        if pd.isna(inicio):
+            return self.marcadores(aba, pd.Timestamp.max, pd.Timestamp.min)
+        return self.marcadores(aba, inicio, inicio + pd.offsets.MonthEnd(0))
+
+
+def calcular(snapshot, anterior=None):
+    etapas = metricas.Etapas('estoque_carga_segundos')
+    dias, series, resumo, desde, movimento = {}, {}, [], {}, {}
+    for aba, materiais in MATERIAIS.items():
+        df = snapshot.dfs[aba]
+        base = None
+        if anterior is not None and snapshot.assinaturas and anterior.assinaturas:
+            base = anterior.series[aba]
+            desde[aba] = dados.linhas_inalteradas(snapshot.assinaturas[aba], anterior.assinaturas[aba])
+        series[aba] = _series(df, materiais, base, desde.get(aba, 0))
+        dias[aba] = df['Dias'].reset_index(drop=True)
+        p = snapshot.movimentos[aba]
+        movimento[aba] = dias[aba].iloc[p] if p is not None else None
+        resumo += _resumo(aba, df, materiais, series[aba], p)
+    etapas.marcar('alertas')
+    if desde:
+        log.info('Alertas incrementais: linhas reaproveitadas por aba %s', desde)
+    return Alertas(snapshot.versao, movimento, snapshot.assinaturas, dias, series, resumo)
+
+
+_alertas = None
+_lock = threading.Lock()
+
+
+def para(snapshot):
+    # Alertas da versão do snapshot: calculados na troca dos dados (ao_atualizar) e, se um
+    # callback chegar antes disso, aqui mesmo, uma vez só
+    global _alertas
+    atual = _alertas
+    if atual is not None and atual.versao == snapshot.versao:
+        return atual
+    with _lock:
+        if _alertas is None or _alertas.versao != snapshot.versao:
+            _alertas = calcular(snapshot, _alertas)
+        return _alertas
+
+
+@dados.ao_atualizar
+def _ao_atualizar(snapshot):
+    em_alerta = [linha for linha in para(snapshot).resumo if linha['Alerta']]
+    if em_alerta:
+        log.warning('Estoque com cobertura abaixo de %g dias: %s', LIMITE_DIAS,
+                    ', '.join(f"{linha['Material']} ({linha['Cobertura (dias)']} dias)" for linha in em_alerta))
+
+
+@metricas.coletor
+def _coletar():
+    snapshot = dados.snapshot_atual()
+    if snapshot is None:
+        return
+    resumo = [({'aba': linha['Aba'], 'material': linha['Material']}, linha) for linha in para(snapshot).resumo]
+    com_estoque = [(rotulos, linha) for rotulos, linha in resumo if linha['Estoque (ton.)'] is not None]
+    yield ('estoque_consumo_diario_toneladas', 'gauge',
+           f'Consumo médio diário (Vendas + Obras) nos últimos {JANELA} dias',
+           [(rotulos, linha['Consumo diário (ton.)']) for rotulos, linha in resumo])
+    yield ('estoque_cobertura_dias', 'gauge', 'Dias de estoque com o consumo médio atual (+Inf sem consumo)',
+           [(rotulos, '+Inf' if linha['Cobertura (dias)'] is None else linha['Cobertura (dias)'])
+            for rotulos, linha in com_estoque])
+    yield ('estoque_alerta', 'gauge', f'1 com cobertura abaixo de {LIMITE_DIAS:g} dias',
+           [(rotulos, int(linha['Alerta'])) for rotulos, linha in com_estoque])
+
+
+def _json(valor):
+    return f'{valor:%Y-%m-%d}' if isinstance(valor, pd.Timestamp) else valor
+
+
+@rotas.route('/api/alertas')
+def listar():
+    snapshot = dados.snapshot_atual()
+    if snapshot is None:
+        flask.abort(flask.Response('Dados ainda carregando', status=503, headers={'Retry-After': '5'}))
+    alertas = para(snapshot)
+    resposta = flask.jsonify({
+        'versao': snapshot.versao,
+        'janela_dias': JANELA, 'limite_dias': LIMITE_DIAS, 'horizonte_dias': HORIZONTE,
+        'materiais': [{chave: _json(valor) for chave, valor in linha.items()}
+                      for linha in alertas.resumo],
+    })
+    resposta.set_etag(snapshot.versao[:32])
+    resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta.make_conditional(flask.request)
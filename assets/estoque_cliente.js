@@ -0,0 +1,174 @@
+// Modo cliente (ESTOQUE_MODO_CLIENTE=1): os dados compactos de todos os meses chegam uma
+// vez no dcc.Store 'dados-estoque' e os gráficos são montados aqui, sem ir ao servidor.
+// Reproduz os gráficos dos callbacks de Estoque_IIPG.py.
+
+(function () {
+    var DIA_MS = 86400000;
+
+    function mesVazio() {
+        return {Dias: [], obs: {Dias: [], Obs: []}, alertas: {Dias: [], Texto: []}, totais: {}};
+    }
+
+    function dadosMes(dados, aba, mes) {
+        return (dados && dados[aba] && dados[aba][mes]) || mesVazio();
+    }
+
+    function maximo(dadosDoMes, colunas) {
+        var valores = [];
+        colunas.forEach(function (coluna) {
+            valores = valores.concat(dadosDoMes[coluna] || []);
+        });
+        return valores.length ? Math.max.apply(null, valores) : 0;
+    }
+
+    // Equivalente ao px.line + scatter das observações (e dos alertas de estoque)
+    function graficoLinha(d, colunas, nomes, cores, colunasEscala, titulo, mes, rotuloY) {
+        var traces = colunas.map(function (coluna, i) {
+            return {
+                type: 'scatter', mode: 'lines', name: nomes[i], legendgroup: nomes[i],
+                x: d.Dias, y: d[coluna] || [],
+                line: {color: cores[nomes[i]]},
+                hovertemplate: 'Material=' + nomes[i] + '<br>Dias=%{x}<br>' + rotuloY + '=%{y}<extra></extra>'
+            };
+        });
+        traces.push({
+            type: 'scatter', mode: 'markers', name: 'Observação',
+            x: d.obs.Dias, y: d.obs.Dias.map(function () { return 0; }),
+            marker: {color: 'red', size: 10},
+            text: d.obs.Obs, hovertext: d.obs.Obs, textposition: 'top center'
+        });
+        if (d.alertas && d.alertas.Dias.length) {
+            traces.push({
+                type: 'scatter', mode: 'markers', name: 'Alerta de estoque',
+                x: d.alertas.Dias, y: d.alertas.Dias.map(function () { return 0; }),
+                marker: {color: 'orange', size: 10, symbol: 'triangle-up'},
+                hovertext: d.alertas.Texto
+            });
+        }
+        return {
+            data: traces,
+            layout: {
+                title: {text: titulo},
+                legend: {title: {text: 'Material'}},
+                xaxis: {title: {text: mes}, tickmode: 'linear', dtick: DIA_MS, tickformat: '%d'},
+                yaxis: {title: {text: rotuloY}, range: [0, maximo(d, colunasEscala) + 5]}
+            }
+        };
+    }
+
+    function graficoPizza(rotulos, valores, cores, titulo, layoutExtra) {
+        return {
+            data: [{
+                type: 'pie', labels: rotulos, values: valores,
+                marker: {colors: rotulos.map(function (r) { return cores[r]; })}
+            }],
+            layout: Object.assign({title: {text: titulo}, legend: {tracegroupgap: 0}}, layoutExtra || {})
+        };
+    }
+
+    function celula(tipo, conteudo) {
+        return {type: tipo, namespace: 'dash_html_components', props: {children: conteudo}};
+    }
+
+    function linhaTabela(tipo, celulas) {
+        return {type: 'Tr', namespace: 'dash_html_components', props: {children: celulas.map(function (c) {
+            return celula(tipo, c);
+        })}};
+    }
+
+    var SIGLAS = {'Macadame': 'Mac', 'Pó de Pedra': 'Po', 'Pedrisco': 'Ped', 'Brita 1': 'B1', 'Brita 2': 'B2'};
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        estoque: {
+            primario: function (mes, dados) {
+                var d = dadosMes(dados, 'PRIMARIO', mes);
+                var cores = dados.config.cores;
+                var colunas = ['Rocha Detonada', 'Rachão'];
+                var t = d.totais;
+                var vendas = t['Vendas'] || 0;
+                var obras = t['Obras'] || 0;
+                var estoque = (t['Total Producao'] || 0) - (vendas + obras);
+                return [
+                    graficoLinha(d, colunas, colunas, cores.line1, colunas,
+                                 'Estoque - ' + mes, mes, 'Estoque (ton.)'),
+                    graficoPizza(['Vendas', 'Obras', 'Estoque'], [vendas, obras, estoque], cores.pie1,
+                                 'Distribuição de Saída de Materiais - ' + mes)
+                ];
+            },
+
+            secundario: function (mes, dados) {
+                var d = dadosMes(dados, 'SECUNDARIO', mes);
+                var cores = dados.config.cores;
+                var materiais = Object.keys(SIGLAS);
+                var t = d.totais;
+                var vendas = materiais.map(function (m) { return t['Venda ' + SIGLAS[m]] || 0; });
+                var obras = materiais.map(function (m) { return t['Obras ' + SIGLAS[m]] || 0; });
+
+                var barras = {
+                    data: [
+                        {type: 'bar', name: 'Vendas', x: materiais, y: vendas, marker: {color: cores.bar1['Vendas']}},
+                        {type: 'bar', name: 'Obras', x: materiais, y: obras, marker: {color: cores.bar1['Obras']}}
+                    ],
+                    layout: {
+                        title: {text: 'Saídas Totais de Materiais - ' + mes}, barmode: 'group',
+                        legend: {title: {text: 'Categoria'}},
+                        xaxis: {title: {text: 'Material'}}, yaxis: {title: {text: 'Quantidade (ton.)'}}
+                    }
+                };
+
+                var tabela = {
+                    type: 'Table', namespace: 'dash_html_components',
+                    props: {
+                        className: 'tabela-estoque',
+                        children: [
+                            {type: 'Thead', namespace: 'dash_html_components',
+                             props: {children: linhaTabela('Th', ['Material', 'Vendas (ton.)', 'Obras (ton.)'])}},
+                            {type: 'Tbody', namespace: 'dash_html_components',
+                             props: {children: materiais.map(function (m, i) {
+                                 return linhaTabela('Td', [m, vendas[i], obras[i]]);
+                             })}}
+                        ]
+                    }
+                };
+
+                return [
+                    graficoLinha(d, materiais, materiais, cores.line2, materiais,
+                                 'Estoque de Materiais - ' + mes, mes, 'Estoque (ton.)'),
+                    graficoPizza(materiais, materiais.map(function (m) { return t[m] || 0; }), cores.pie2,
+                                 'Distribuição de Materiais no Estoque - ' + mes),
+                    barras,
+                    tabela
+                ];
+            },
+
+            usa_uss: function (mes, unidade, dados) {
+                var d = dadosMes(dados, 'USA&USS', mes);
+                var usina = dados.config.usinas[unidade];
+                var colunas = Object.keys(usina.colunas);
+                var nomes = colunas.map(function (c) { return usina.colunas[c]; });
+                var escala = colunas.filter(function (c, i) {
+                    return ['Pó de Pedra', 'Pedrisco', 'Brita 1', 'Brita 2'].indexOf(nomes[i]) >= 0;
+                });
+
+                var pizzas = usina.pizzas.map(function (pizza) {
+                    var produto = pizza[0], cores = pizza[1], tituloX = pizza[2];
+                    var rotulos = ['Vendas ' + produto, 'Obras ' + produto];
+                    var titulo = 'Distribuição de ' + produto + ' - ' + unidade;
+                    var figura = graficoPizza(rotulos, rotulos.map(function (r) { return d.totais[r] || 0; }), cores,
+                                              titulo, {title: {text: titulo, x: tituloX}});
+                    figura.data[0].labels = ['Vendas', 'Consumo'];
+                    return {
+                        type: 'Graph', namespace: 'dash_core_components',
+                        props: {figure: figura, style: {width: usina.largura, display: 'inline-block'}}
+                    };
+                });
+
+                return [
+                    graficoLinha(d, colunas, nomes, usina.cores, escala,
+                                 'Entrada de Materiais ' + unidade + ' - ' + mes, mes, 'Quantidade (ton.)'),
+                    {type: 'Div', namespace: 'dash_html_components', props: {children: pizzas}}
+                ];
+            }
+        }
+    });
+})();
@@ -0,0 +1,403 @@
+# Benchmark da carga dos dados e dos callbacks do dashboard, sem rede.
+#
+# Mede a planilha do repositório e planilhas sintéticas com 1, 5 e 20 anos de dias:
+# tempo de cada etapa da carga, pico de memória, latência p50/p95 de cada callback
+# (primeira chamada, sem cache de figuras, e as seguintes) e bytes das respostas, para
+# cada combinação de mês/usina. Cada planilha roda num processo separado, com cache
+# próprio, para que uma medida não aqueça a seguinte.
+#
+#   python benchmarks/bench_estoque.py                      # tudo, salva em benchmarks/resultados/
+#   python benchmarks/bench_estoque.py --anos 1 --meses 3   # rápido
+#   python benchmarks/bench_estoque.py --comparar benchmarks/resultados/<anterior>.json
+#
+# Mede também a partida: a importação do app num processo novo, sem cache nem rede, que
+# precisa caber em --orcamento-importacao segundos. Termina com código 1 se passar do
+# orçamento ou, com --comparar, se alguma medida piorar mais que --tolerancia.
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLANILHA = os.path.join(RAIZ, 'Long_Estoque IIPG.xlsx')
+RESULTADOS = os.path.join(RAIZ, 'benchmarks', 'resultados')
+
+# Pioras abaixo destes valores absolutos são ruído de medida, não regressão
+MINIMOS = {'_s': 0.005, '_ms': 5, '_mb': 1, 'bytes': 1024}
+
+# Módulos que não deveriam ser importados na partida (só no primeiro uso)
+MODULOS_PESADOS = ['pandas', 'numpy', 'plotly.express', 'openpyxl']
+
+
+# PLANILHAS SINTÉTICAS #
+
+def gerar_planilha(anos, destino):
+    # Repete as linhas da planilha real em sequência, com dias e 'Indice mês' refeitos,
+    # até cobrir o número de anos pedido. Os valores (já calculados pelas fórmulas) são
+    # gravados como constantes
+    from openpyxl import Workbook, load_workbook
+
+    import pandas as pd
+
+    import dados
+
+    origem = load_workbook(PLANILHA, read_only=True, data_only=True)
+    wb = Workbook(write_only=True)
+    try:
+        for aba in dados.ABAS:
+            cabecalho, *registros = origem[aba].iter_rows(values_only=True)
+            registros = [linha for linha in registros if any(valor is not None for valor in linha)]
+            i_dias, i_indice = cabecalho.index('Dias'), cabecalho.index('Indice mês')
+            dias = pd.date_range(registros[0][i_dias], periods=round(anos * 365.25), freq='D')
+
+            ws = wb.create_sheet(aba)
+            ws.append(cabecalho)
+            for n, dia in enumerate(dias):
+                linha = list(registros[n % len(registros)])
+                linha[i_dias] = dia.to_pydatetime()
+                linha[i_indice] = (dia.year - dias[0].year) * 12 + dia.month - dias[0].month + 1
+                ws.append(linha)
+        wb.save(destino)
+    finally:
+        origem.close()
+
+
+# MEDIDAS (processo filho) #
+
+def percentis(valores):
+    import numpy as np
+
+    if not valores:
+        return {'p50': None, 'p95': None}
+    return {'p50': float(np.percentile(valores, 50)), 'p95': float(np.percentile(valores, 95))}
+
+
+def cronometrar(func, *args):
+    inicio = time.perf_counter()
+    resultado = func(*args)
+    return resultado, time.perf_counter() - inicio
+
+
+def medir_carga(conteudo):
+    import pandas as pd
+
+    import dados
+
+    etapas = {}
+    linhas, etapas['leitura_s'] = cronometrar(dados._linhas_planilha, conteudo)
+
+    normalizados, etapas['normalizacao_s'] = {}, 0.0
+    for aba in dados.ABAS:
+        cabecalho, *registros = linhas[aba]
+        df = pd.DataFrame(registros, columns=dados._cabecalho(cabecalho))
+        # Inclui a leitura das datas e a derivação de 'Mês'
+        normalizados[aba], tempo = cronometrar(dados.normalizar_aba, aba, df)
+        etapas['normalizacao_s'] += tempo
+
+    dfs, etapas['compactacao_s'] = cronometrar(
+        lambda: {aba: dados.compactar(df) for aba, df in normalizados.items()})
+    _, etapas['indexacao_s'] = cronometrar(dados.Snapshot, dfs, 'bench', datetime.now())
+
+    # Caminho completo: leitura do arquivo, tratamento, índices e gravação do cache em disco
+    _, etapas['total_s'] = cronometrar(dados.atualizar)
+    # Outro processo subindo com o cache em disco já pronto
+    _, etapas['cache_s'] = cronometrar(dados.carregar_snapshot)
+
+    tracemalloc.start()
+    dados.processar_planilha(conteudo, 'bench', datetime.now())
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    snapshot = dados.snapshot_atual()
+    memoria = {
+        'pico_carga_mb': pico / 2 ** 20,
+        'snapshot_mb': sum(df.memory_usage(deep=True).sum() for df in snapshot.dfs.values()) / 2 ** 20,
+    }
+    linhas_por_aba = {aba: len(df) for aba, df in snapshot.dfs.items()}
+    return etapas, memoria, linhas_por_aba
+
+
+def requisicoes(m, snapshot, meses):
+    # (callback, saídas, entradas) de cada combinação de mês/usina e dos intervalos
+    # da comparação entre períodos, sempre com a aba da seção aberta
+    for mes in meses:
+        yield ('primario', ['line1-graph.figure', 'pie1-graph.figure'],
+               [('month-dropdown', 'value', mes), ('secoes-tabs', 'value', 'primario')])
+        yield ('secundario',
+               ['line2-graph.figure', 'pie2-graph.figure', 'bar1-graph.figure', 'table-div.children'],
+               [('month-dropdown', 'value', mes), ('secoes-tabs', 'value', 'secundario')])
+        for unidade in m.USINAS:
+            yield ('usa-uss', ['usa-uss-graph.figure', 'usa-uss-pie-graphs.children'],
+                   [('month-dropdown', 'value', mes), ('unit-dropdown', 'value', unidade),
+                    ('secoes-tabs', 'value', 'usa-uss')])
+    for n in [3, 6, 12]:
+        inicio, fim = m.periodo_recente(snapshot, n)
+        for granularidade in ['mes', 'semana']:
+            yield ('comparacao',
+                   ['comparacao-diario-graph.figure', 'comparacao-estoque-graph.figure',
+                    'comparacao-saidas-graph.figure', 'comparacao-usinas-graph.figure'],
+                   [('periodo-range', 'start_date', str(inicio.date())),
+                    ('periodo-range', 'end_date', str(fim.date())),
+                    ('granularidade-radio', 'value', granularidade),
+                    ('secoes-tabs', 'value', 'comparacao')])
+
+
+def medir_callbacks(m, snapshot, meses, repeticoes):
+    import metricas
+
+    cliente = m.server.test_client()
+    medidas = {}
+    for nome, saidas, entradas in requisicoes(m, snapshot, meses):
+        chave = '..' + '...'.join(saidas) + '..'
+        corpo = {
+            'output': chave,
+            'outputs': [dict(zip(['id', 'property'], saida.split('.'))) for saida in saidas],
+            'inputs': [{'id': id_, 'property': prop, 'value': valor} for id_, prop, valor in entradas],
+            'changedPropIds': [f'{entradas[0][0]}.{entradas[0][1]}'],
+        }
+        medida = medidas.setdefault(nome, {'frio_ms': [], 'quente_ms': [], 'bytes': [], 'bytes_enviados': []})
+        for i in range(1 + repeticoes):
+            antes = dict(metricas.bytes_callbacks[chave])
+            resposta, tempo = cronometrar(lambda: cliente.post('/_dash-update-component', json=corpo,
+                                                               headers={'Accept-Encoding': 'br, gzip'}))
+            if resposta.status_code != 200:
+                raise RuntimeError(f'{nome} {entradas}: HTTP {resposta.status_code}')
+            medida['frio_ms' if i == 0 else 'quente_ms'].append(tempo * 1000)
+            if i == 0:
+                depois = metricas.bytes_callbacks[chave]
+                medida['bytes'].append(depois['bytes'] - antes['bytes'])
+                medida['bytes_enviados'].append(depois['bytes_enviados'] - antes['bytes_enviados'])
+
+    return {
+        nome: {
+            'chamadas': len(medida['frio_ms']) + len(medida['quente_ms']),
+            'frio_ms': percentis(medida['frio_ms']),
+            'quente_ms': percentis(medida['quente_ms']),
+            'bytes': percentis(medida['bytes']),
+            'bytes_enviados': percentis(medida['bytes_enviados']),
+        }
+        for nome, medida in medidas.items()
+    }
+
+
+def medir(caminho, repeticoes, meses):
+    sys.path.insert(0, RAIZ)
+    import dados
+
+    # Sem rede: a fonte é o próprio arquivo (ESTOQUE_FONTE)
+    with open(caminho, 'rb') as f:
+        conteudo = f.read()
+
+    etapas, memoria, linhas = medir_carga(conteudo)
+
+    import_inicio = time.perf_counter()
+    import Estoque_IIPG as m
+    etapas['importacao_app_s'] = time.perf_counter() - import_inicio
+
+    snapshot = dados.snapshot_atual()
+    todos = list(snapshot.meses['PRIMARIO'])
+    # Os últimos N meses com dados: a planilha já traz as linhas zeradas do resto do ano
+    ultimo = f'{snapshot.ultimo_movimento():%Y-%m}'
+    recentes = [mes for mes in todos if mes <= ultimo][-meses:]
+    callbacks = medir_callbacks(m, snapshot, recentes if meses else todos, repeticoes)
+
+    memoria['rss_max_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {'linhas': linhas, 'carga': etapas, 'memoria': memoria, 'callbacks': callbacks}
+
+
+# PARTIDA #
+
+def medir_partida(repeticoes):
+    # Importação do app num processo novo (sem cache, sem planilha local e sem rede), o
+    # que separa o início do processo da abertura da porta. A menor de algumas medidas
+    codigo = ('import sys, time; inicio = time.perf_counter(); import Estoque_IIPG; '
+              'print(time.perf_counter() - inicio, *[m for m in sys.argv[1:] if m in sys.modules])')
+    tempos = []
+    with tempfile.TemporaryDirectory() as cache:
+        ambiente = dict(os.environ,
+                        ESTOQUE_CACHE_DIR=cache,
+                        ESTOQUE_PLANILHA_LOCAL=os.path.join(cache, 'inexistente.xlsx'),
+                        ESTOQUE_LOG='WARNING')
+        for _ in range(max(1, repeticoes)):
+            processo = subprocess.run([sys.executable, '-c', codigo, *MODULOS_PESADOS], cwd=RAIZ,
+                                      env=ambiente, capture_output=True, text=True)
+            if processo.returncode != 0:
+                sys.stderr.write(processo.stderr)
+                raise SystemExit('Falha ao importar o app')
+            tempo, *pesados = processo.stdout.strip().splitlines()[-1].split()
+            tempos.append(float(tempo))
+    return {'importacao_s': min(tempos), 'modulos_pesados': pesados}
+
+
+# EXECUÇÃO E COMPARAÇÃO (processo principal) #
+
+def rodar_planilha(caminho, args):
+    with tempfile.TemporaryDirectory() as cache:
+        ambiente = dict(os.environ,
+                        ESTOQUE_CACHE_DIR=cache,
+                        ESTOQUE_FONTE=caminho,
+                        ESTOQUE_CACHE_BACKEND='memoria',
+                        ESTOQUE_CACHE_AQUECER_MESES='0',
+                        ESTOQUE_CACHE_VALIDADE='0',
+                        ESTOQUE_INTERVALO_ATUALIZACAO='0',
+                        ESTOQUE_MODO_CLIENTE='0',
+                        ESTOQUE_LOG='WARNING')
+        comando = [sys.executable, os.path.abspath(__file__), '--medir', caminho,
+                   '--repeticoes', str(args.repeticoes), '--meses', str(args.meses)]
+        processo = subprocess.run(comando, env=ambiente, capture_output=True, text=True)
+    if processo.returncode != 0:
+        sys.stderr.write(processo.stderr)
+        raise SystemExit(f'Falha ao medir {caminho}')
+    return json.loads(processo.stdout.strip().splitlines()[-1])
+
+
+def versao_codigo():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def pacotes():
+    from importlib import metadata
+
+    versoes = {}
+    for pacote in ['dash', 'pandas', 'plotly', 'numpy', 'openpyxl']:
+        try:
+            versoes[pacote] = metadata.version(pacote)
+        except metadata.PackageNotFoundError:
+            versoes[pacote] = None
+    return versoes
+
+
+def folhas(resultado, caminho=()):
+    # Medidas numéricas achatadas: ('1 ano', 'callbacks', 'primario', 'frio_ms', 'p95') -> valor
+    if isinstance(resultado, dict):
+        for chave, valor in resultado.items():
+            yield from folhas(valor, caminho + (chave,))
+    elif isinstance(resultado, (int, float)) and not isinstance(resultado, bool):
+        yield caminho, resultado
+
+
+def minimo(caminho):
+    for sufixo, valor in MINIMOS.items():
+        if any(parte.endswith(sufixo) for parte in caminho):
+            return valor
+    return None
+
+
+def medidas(resultado):
+    return folhas({'partida': resultado.get('partida', {}), **resultado['planilhas']})
+
+
+def comparar(anterior, atual, tolerancia):
+    base = dict(medidas(anterior))
+    pioras = []
+    print(f"\nComparando com {anterior.get('versao')} ({anterior.get('data')}):")
+    for caminho, valor in medidas(atual):
+        limite = minimo(caminho)
+        if caminho not in base or limite is None or 'linhas' in caminho:
+            continue
+        antes = base[caminho]
+        variacao = (valor - antes) / antes if antes else 0.0
+        piorou = valor - antes > limite and variacao > tolerancia
+        if piorou or abs(variacao) > tolerancia:
+            marca = 'PIOROU' if piorou else ('melhorou' if valor < antes else '')
+            print(f"  {' / '.join(caminho):70} {antes:12.3f} -> {valor:12.3f} ({variacao:+.0%}) {marca}")
+        if piorou:
+            pioras.append(caminho)
+    return pioras
+
+
+def resumir(nome, resultado):
+    carga, memoria = resultado['carga'], resultado['memoria']
+    print(f"\n{nome}: {resultado['linhas']['PRIMARIO']} dias")
+    print('  carga: ' + ', '.join(f'{etapa[:-2]} {tempo * 1000:.0f} ms' for etapa, tempo in carga.items()))
+    print(f"  memória: pico na carga {memoria['pico_carga_mb']:.1f} MB, snapshot {memoria['snapshot_mb']:.1f} MB, "
+          f"RSS máx. {memoria['rss_max_mb']:.0f} MB")
+    for callback, medida in resultado['callbacks'].items():
+        print(f"  {callback:11} frio p50/p95 {medida['frio_ms']['p50']:7.1f}/{medida['frio_ms']['p95']:7.1f} ms"
+              f"  quente p50/p95 {medida['quente_ms']['p50'] or 0:6.1f}/{medida['quente_ms']['p95'] or 0:6.1f} ms"
+              f"  bytes p50 {medida['bytes']['p50']:8.0f} (enviados {medida['bytes_enviados']['p50']:7.0f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark da carga e dos callbacks do Estoque IIPG')
+    parser.add_argument('--anos', type=float, nargs='*', default=[1, 5, 20],
+                        help='anos de dias das planilhas sintéticas (nenhum: só a planilha real)')
+    parser.add_argument('--repeticoes', type=int, default=3,
+                        help='chamadas repetidas de cada callback depois da primeira')
+    parser.add_argument('--meses', type=int, default=0,
+                        help='mede só os últimos N meses com dados (0: todos)')
+    parser.add_argument('--saida', help='arquivo JSON dos resultados')
+    parser.add_argument('--comparar', help='resultados anteriores para comparar')
+    parser.add_argument('--tolerancia', type=float, default=0.25,
+                        help='piora relativa aceita antes de acusar regressão')
+    parser.add_argument('--orcamento-importacao', type=float,
+                        default=float(os.environ.get('ESTOQUE_ORCAMENTO_IMPORTACAO', 2)),
+                        help='tempo máximo (s) de importação do app na partida')
+    parser.add_argument('--medir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        print(json.dumps(medir(args.medir, args.repeticoes, args.meses)))
+        return 0
+
+    sys.path.insert(0, RAIZ)
+    resultado = {'versao': versao_codigo(), 'data': datetime.now().isoformat(timespec='seconds'),
+                 'python': platform.python_version(), 'pacotes': pacotes(),
+                 'parametros': {'repeticoes': args.repeticoes, 'meses': args.meses}, 'planilhas': {}}
+
+    print('Medindo a partida...', flush=True)
+    resultado['partida'] = medir_partida(args.repeticoes)
+    partida = resultado['partida']
+    print(f"\npartida: importação {partida['importacao_s'] * 1000:.0f} ms "
+          f"(orçamento {args.orcamento_importacao * 1000:.0f} ms), módulos pesados: "
+          f"{', '.join(partida['modulos_pesados']) or 'nenhum'}\n")
+
+    with tempfile.TemporaryDirectory() as pasta:
+        planilhas = [('planilha', PLANILHA)]
+        for anos in args.anos:
+            nome = f'{anos:g} ano' + ('s' if anos != 1 else '')
+            caminho = os.path.join(pasta, f'sintetica-{anos:g}.xlsx')
+            print(f'Gerando planilha sintética de {nome}...', flush=True)
+            gerar_planilha(anos, caminho)
+            planilhas.append((nome, caminho))
+
+        for nome, caminho in planilhas:
+            print(f'Medindo {nome}...', flush=True)
+            resultado['planilhas'][nome] = rodar_planilha(caminho, args)
+            resumir(nome, resultado['planilhas'][nome])
+
+    saida = args.saida or os.path.join(
+        RESULTADOS, f"{datetime.now():%Y%m%d-%H%M%S}-{resultado['versao'] or 'sem-git'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f'\nResultados salvos em {saida}')
+
+    falhou = False
+    if partida['importacao_s'] > args.orcamento_importacao:
+        print(f"\nImportação do app em {partida['importacao_s']:.2f} s, acima do orçamento de "
+              f"{args.orcamento_importacao:.2f} s")
+        falhou = True
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            pioras = comparar(json.load(f), resultado, args.tolerancia)
+        if pioras:
+            print(f'\n{len(pioras)} medida(s) piorou(aram) mais de {args.tolerancia:.0%}')
+            falhou = True
+    return 1 if falhou else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
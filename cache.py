@@ -0,0 +1,252 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from plotly.io.json import to_json_plotly
+
+import dados
+import metricas
+
+log = logging.getLogger('estoque.cache')
+
+# Onde guardar as figuras já serializadas: 'memoria' (por processo), 'disco'
+# (compartilhado pelos workers da máquina) ou 'redis' (compartilhado entre máquinas)
+BACKEND = os.environ.get('ESTOQUE_CACHE_BACKEND', 'memoria')
+# Limite de espaço (MB) das figuras guardadas
+MAX_MB = float(os.environ.get('ESTOQUE_CACHE_FIGURAS_MB', 64))
+CACHE_FIGURAS_DIR = os.path.join(dados.CACHE_DIR, 'figuras')
+REDIS_URL = os.environ.get('ESTOQUE_REDIS_URL', 'redis://localhost:6379/0')
+# Validade (s) das chaves no Redis, para que versões antigas expirem sozinhas
+REDIS_TTL = int(os.environ.get('ESTOQUE_REDIS_TTL', 7 * 24 * 3600))
+
+
+# Interface comum: chaves são strings '<versão>:<seção>:<entradas>' e valores são bytes.
+# Começar pela versão dos dados permite descartar de uma vez as versões antigas
+class Backend:
+    def __init__(self):
+        self.acertos = 0
+        self.faltas = 0
+
+    def obter(self, chave):
+        valor = self._obter(chave)
+        if valor is None:
+            self.faltas += 1
+        else:
+            self.acertos += 1
+        return valor
+
+    def guardar(self, chave, valor):
+        raise NotImplementedError
+
+    def descartar_versoes(self, exceto):
+        raise NotImplementedError
+
+    def _obter(self, chave):
+        raise NotImplementedError
+
+
+# LRU em memória limitado pelo total de bytes guardados, e não pelo número de itens
+class CacheLRU(Backend):
+    def __init__(self, max_bytes=int(MAX_MB * 1024 * 1024)):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self._itens = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _obter(self, chave):
+        with self._lock:
+            valor = self._itens.get(chave)
+            if valor is not None:
+                self._itens.move_to_end(chave)
+            return valor
+
+    def guardar(self, chave, valor):
+        tamanho = len(valor)
+        if tamanho > self.max_bytes:
+            return
+        with self._lock:
+            anterior = self._itens.pop(chave, None)
+            if anterior is not None:
+                self._bytes -= len(anterior)
+            self._itens[chave] = valor
+            self._bytes += tamanho
+            while self._bytes > self.max_bytes:
+                _, removido = self._itens.popitem(last=False)
+                self._bytes -= len(removido)
+
+    def descartar_versoes(self, exceto):
+        with self._lock:
+            for chave in [c for c in self._itens if not c.startswith(f'{exceto}:')]:
+                self._bytes -= len(self._itens.pop(chave))
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._itens)
+
+
+# Um arquivo por chave, numa pasta por versão dos dados. Gravação atômica, então
+# vários workers podem ler e gravar ao mesmo tempo
+class CacheDisco(Backend):
+    def __init__(self, diretorio=CACHE_FIGURAS_DIR, max_bytes=int(MAX_MB * 1024 * 1024)):
+        super().__init__()
+        self.diretorio = diretorio
+        self.max_bytes = max_bytes
+
+    def _caminho(self, chave):
+        versao, _, resto = chave.partition(':')
+        nome = hashlib.sha1(resto.encode('utf-8')).hexdigest()
+        return os.path.join(self.diretorio, versao, nome)
+
+    def _obter(self, chave):
+        caminho = self._caminho(chave)
+        try:
+            with open(caminho, 'rb') as f:
+                valor = f.read()
+            # Marca o acesso mesmo em sistemas de arquivos montados com noatime
+            os.utime(caminho)
+        except OSError:
+            return None
+        return valor
+
+    def guardar(self, chave, valor):
+        caminho = self._caminho(chave)
+        try:
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(caminho), prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(valor)
+            os.replace(tmp, caminho)
+        except OSError:
+            log.warning('Não foi possível gravar %s', caminho, exc_info=True)
+            return
+        self._limitar(os.path.dirname(caminho))
+
+    def _limitar(self, pasta):
+        # Remove os arquivos menos usados recentemente quando a pasta passa do limite
+        arquivos = []
+        for entrada in os.scandir(pasta):
+            if entrada.is_file() and not entrada.name.startswith('.tmp-'):
+                info = entrada.stat()
+                arquivos.append((info.st_mtime, info.st_size, entrada.path))
+        total = sum(tamanho for _, tamanho, _ in arquivos)
+        for _, tamanho, caminho in sorted(arquivos):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(caminho)
+            except OSError:
+                pass
+            total -= tamanho
+
+    def descartar_versoes(self, exceto):
+        try:
+            pastas = os.listdir(self.diretorio)
+        except OSError:
+            return
+        for pasta in pastas:
+            if pasta != exceto:
+                shutil.rmtree(os.path.join(self.diretorio, pasta), ignore_errors=True)
+
+
+# Qualquer cliente compatível com redis-py (get/set/scan_iter/delete) serve,
+# inclusive um substituto local em testes
+class CacheRedis(Backend):
+    def __init__(self, cliente, prefixo='estoque:figuras:', ttl=REDIS_TTL):
+        super().__init__()
+        self.cliente = cliente
+        self.prefixo = prefixo
+        self.ttl = ttl
+
+    def _obter(self, chave):
+        return self.cliente.get(self.prefixo + chave)
+
+    def guardar(self, chave, valor):
+        self.cliente.set(self.prefixo + chave, valor, ex=self.ttl)
+
+    def descartar_versoes(self, exceto):
+        manter = f'{self.prefixo}{exceto}:'.encode('utf-8')
+        for chave in self.cliente.scan_iter(match=self.prefixo + '*'):
+            chave_bytes = chave if isinstance(chave, bytes) else chave.encode('utf-8')
+            if not chave_bytes.startswith(manter):
+                self.cliente.delete(chave)
+
+
+def criar_backend(nome=BACKEND):
+    if nome == 'memoria':
+        return CacheLRU()
+    if nome == 'disco':
+        return CacheDisco()
+    if nome == 'redis':
+        import redis
+        return CacheRedis(redis.Redis.from_url(REDIS_URL))
+    raise ValueError(f'Backend de cache desconhecido: {nome}')
+
+
+cache_figuras = criar_backend()
+
+
+# Dados novos tornam as figuras antigas inúteis: as chaves levam a versão, então
+# elas nunca são servidas, e aqui só liberamos o espaço
+@dados.ao_atualizar
+def _invalidar(snapshot):
+    cache_figuras.descartar_versoes(exceto=snapshot.versao)
+
+
+@metricas.coletor
+def _coletar():
+    acertos, faltas = cache_figuras.acertos, cache_figuras.faltas
+    rotulos = {'backend': BACKEND}
+    yield ('estoque_cache_figuras_acertos_total', 'counter', 'Figuras servidas do cache', [(rotulos, acertos)])
+    yield ('estoque_cache_figuras_faltas_total', 'counter', 'Figuras calculadas por não estarem no cache',
+           [(rotulos, faltas)])
+    yield ('estoque_cache_figuras_taxa_acerto', 'gauge', 'Fração das consultas ao cache de figuras com acerto',
+           [(rotulos, acertos / (acertos + faltas) if acertos + faltas else 0)])
+    if isinstance(cache_figuras, CacheLRU):
+        yield ('estoque_cache_figuras_bytes', 'gauge', 'Bytes das figuras guardadas em memória',
+               [(rotulos, cache_figuras.bytes)])
+        yield ('estoque_cache_figuras_itens', 'gauge', 'Figuras guardadas em memória',
+               [(rotulos, len(cache_figuras))])
+
+
+def em_cache(secao):
+    # Decora func(snapshot, *entradas): guarda o JSON do resultado por
+    # (versão dos dados, seção, entradas) e o devolve direto nas próximas chamadas.
+    # Devolve sempre o JSON decodificado (dicts e listas), e não figuras do Plotly
+    def decorador(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            snapshot = dados.snapshot_atual()
+            chave = ':'.join([snapshot.versao, secao, *map(str, args)])
+            etapas = metricas.Etapas('estoque_etapa_segundos', secao=secao)
+            try:
+                guardado = cache_figuras.obter(chave)
+            except Exception:
+                log.warning('Falha ao consultar o cache de figuras', exc_info=True)
+                guardado = None
+            if guardado is not None:
+                resultado = json.loads(guardado)
+                etapas.marcar('cache')
+                return resultado
+            resultado = func(snapshot, *args)
+            etapas = metricas.Etapas('estoque_etapa_segundos', secao=secao)
+            serializado = to_json_plotly(resultado).encode('utf-8')
+            etapas.marcar('serializacao')
+            try:
+                cache_figuras.guardar(chave, serializado)
+            except Exception:
+                log.warning('Falha ao gravar no cache de figuras', exc_info=True)
+            # Também aqui o JSON decodificado: quem chama recebe o mesmo tipo, tenha a
+            # figura vindo do cache ou não
+            return json.loads(serializado)
+        return wrapper
+    return decorador
@@ -0,0 +1,811 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import InitVar, dataclass, field
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from io import BytesIO
+
+import requests
+
+import metricas
+from importacao import tardia
+
+# Importados no primeiro uso, fora da inicialização do servidor
+np = tardia('numpy')
+pd = tardia('pandas')
+
+log = logging.getLogger('estoque.dados')
+
+# URLs das planilhas no GitHub (substituindo espaços por %20)
+url_base = 'https://github.com/JacoLucas/EstoqueIIPG/raw/main/Long_Estoque IIPG.xlsx'
+
+# De onde vem a planilha: uma URL (padrão: o arquivo no GitHub), o caminho de um arquivo
+# ou uma pasta (p.ex. um volume montado), da qual se usa a planilha modificada por último.
+# Arquivos e pastas são lidos sem rede e vigiados a cada rodada do atualizador
+FONTE = os.environ.get('ESTOQUE_FONTE', url_base)
+
+# Abas lidas da planilha (todas numa única leitura)
+ABAS = ['PRIMARIO', 'SECUNDARIO', 'USA&USS']
+
+# Toneladas com 2 casas decimais: as fórmulas da planilha geram resíduos como
+# -84.72000000000001, que só aumentam o JSON enviado ao navegador
+CASAS_DECIMAIS = 2
+
+# Cache local dos DataFrames já tratados
+CACHE_DIR = os.environ.get('ESTOQUE_CACHE_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+CACHE_DADOS = os.path.join(CACHE_DIR, 'planilhas.pkl')
+CACHE_META = os.path.join(CACHE_DIR, 'planilhas.json')
+# Cópia do arquivo original, para refazer o cache sem rede quando o formato mudar
+CACHE_PLANILHA = os.path.join(CACHE_DIR, 'planilha.xlsx')
+# Só um processo da máquina busca e trata cada versão; os outros usam o cache gravado
+CACHE_LOCK = os.path.join(CACHE_DIR, 'planilhas.lock')
+
+# Com o pyarrow instalado, os DataFrames vão para arquivos Arrow (Feather v2, sem
+# compressão) mapeados em memória: os workers da máquina leem as mesmas páginas do cache
+# do sistema, sem cópia, em vez de cada um ter a sua. Sem ele (ou com 0), ficam no pickle
+SNAPSHOT_ARROW = os.environ.get('ESTOQUE_SNAPSHOT_ARROW', '1') == '1'
+# Incrementar sempre que normalizar_aba()/ler_planilha() mudarem o resultado
+FORMATO_CACHE = 4
+
+# Tempo (s) em que o cache é usado sem consultar a fonte; 0 sempre revalida
+CACHE_VALIDADE = float(os.environ.get('ESTOQUE_CACHE_VALIDADE', 0))
+TIMEOUT = float(os.environ.get('ESTOQUE_TIMEOUT', 15))
+
+# Intervalo (s) entre consultas do atualizador em segundo plano; 0 desativa
+INTERVALO_ATUALIZACAO = float(os.environ.get('ESTOQUE_INTERVALO_ATUALIZACAO', 300))
+
+# Planilha que acompanha o código: usada na partida, sem rede, quando não há cache em disco
+PLANILHA_LOCAL = os.environ.get('ESTOQUE_PLANILHA_LOCAL',
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Long_Estoque IIPG.xlsx'))
+
+
+def _fatias(df, chave):
+    if chave.is_monotonic_increasing:
+        # Dias em ordem: cada mês é um trecho contínuo, e as fatias por posição são
+        # vistas do DataFrame em vez de cópias das linhas
+        valores = chave.to_numpy()
+        mudancas = np.flatnonzero(valores[1:] != valores[:-1]) + 1
+        inicios = np.r_[0, mudancas] if len(valores) else mudancas
+        fins = np.r_[inicios[1:], len(valores)]
+        meses = {valores[i]: df.iloc[i:f] for i, f in zip(inicios, fins)}
+    else:
+        meses = {mes: fatia for mes, fatia in df.groupby(chave, sort=True)}
+    obs = df[df['Obs'].notna()]
+    observacoes = {mes: fatia for mes, fatia in obs.groupby(chave[obs.index], sort=True)}
+    return meses, observacoes
+
+
+def _totais(df, chave):
+    # Somas em float64: acumular float32 perderia os centavos de tonelada
+    return _para_float64(df).groupby(chave, sort=True).sum(numeric_only=True).round(CASAS_DECIMAIS)
+
+
+def indexar(dfs, anterior=None, desde=None):
+    # Agrupa cada aba por 'Mês' uma única vez: fatias por mês, linhas com observação
+    # e uma tabela de totais (soma de cada coluna numérica) por mês. Com o snapshot
+    # anterior e a primeira linha alterada de cada aba (desde), os totais dos meses
+    # inteiramente anteriores a ela são reaproveitados e só os demais são somados. As
+    # fatias são sempre refeitas sobre o DataFrame novo (são vistas, quase de graça):
+    # as do snapshot anterior prenderiam em memória o DataFrame da versão de onde vieram
+    meses, observacoes, totais = {}, {}, {}
+    for aba, df in dfs.items():
+        chave = df['Mês'].astype(str)
+        meses[aba], observacoes[aba] = _fatias(df, chave)
+        inicio = desde.get(aba, 0) if anterior is not None else 0
+        if inicio <= 0 or not df['Dias'].is_monotonic_increasing:
+            totais[aba] = _totais(df, chave)
+            continue
+
+        # Sem linha alterada, a aba pode ter só perdido dias do fim (é um prefixo da
+        # anterior): o mês da última linha é refeito e os seguintes deixam de existir
+        primeiro_mes = chave.iloc[min(inicio, len(df) - 1)]
+        corte = int((chave < primeiro_mes).sum())
+        totais_anteriores = anterior.totais[aba]
+        totais[aba] = pd.concat([totais_anteriores[totais_anteriores.index < primeiro_mes],
+                                 _totais(df.iloc[corte:], chave.iloc[corte:])])
+    return meses, observacoes, totais
+
+
+# Períodos dos agregados usados na comparação entre períodos: semanas (de segunda a
+# domingo) e meses, rotulados pelo primeiro dia
+def _ultimo_movimento(aba, df):
+    # Posição do último dia até hoje com algum lançamento (ou variação de saldo): a
+    # planilha já traz as linhas do resto do ano zeradas, e elas não são dados
+    saldos = [coluna for coluna in RENOMEAR[aba].values() if coluna in df]
+    lancamentos = df.select_dtypes('number').drop(columns=[*saldos, 'Indice mês'], errors='ignore')
+    movimento = lancamentos.ne(0).any(axis=1) | df[saldos].diff().fillna(0).ne(0).any(axis=1)
+    passados = np.flatnonzero((movimento & (df['Dias'] <= pd.Timestamp.today())).to_numpy())
+    return int(passados[-1]) if len(passados) else None
+
+
+FREQUENCIAS = {
+    'semana': 'W-MON',
+    'mes': 'MS'
+}
+
+
+def agregar(dfs):
+    # Soma e valor no fim do período de todas as colunas numéricas, num resample
+    # vetorizado por aba e frequência. Calculado uma vez por versão dos dados, então um
+    # intervalo de um ano custa um recorte destas tabelas, e não um laço pelos meses
+    agregados = {}
+    for aba, df in dfs.items():
+        numericas = _para_float64(df.set_index('Dias').select_dtypes('number'))
+        agregados[aba] = {}
+        for frequencia, regra in FREQUENCIAS.items():
+            periodos = numericas.resample(regra, label='left', closed='left')
+            agregados[aba][frequencia] = {'soma': periodos.sum().round(CASAS_DECIMAIS),
+                                          'fim': periodos.last()}
+    return agregados
+
+
+# Versão imutável dos dados: trocada inteira a cada atualização, nunca alterada no lugar.
+# assinaturas guarda um hash de cada linha bruta da planilha, para a leitura incremental
+# da próxima versão; base = (snapshot anterior, primeira linha alterada por aba)
+@dataclass(frozen=True)
+class Snapshot:
+    dfs: dict
+    versao: str
+    atualizado_em: datetime
+    assinaturas: dict = field(default=None, repr=False)
+    base: InitVar[tuple] = None
+    meses: dict = field(init=False, repr=False)
+    observacoes: dict = field(init=False, repr=False)
+    totais: dict = field(init=False, repr=False)
+    agregados: dict = field(init=False, repr=False)
+    movimentos: dict = field(init=False, repr=False)
+
+    def __post_init__(self, base):
+        meses, observacoes, totais = indexar(self.dfs, *(base or ()))
+        object.__setattr__(self, 'meses', meses)
+        object.__setattr__(self, 'observacoes', observacoes)
+        object.__setattr__(self, 'totais', totais)
+        object.__setattr__(self, 'agregados', agregar(self.dfs))
+        object.__setattr__(self, 'movimentos', {aba: _ultimo_movimento(aba, df) for aba, df in self.dfs.items()})
+
+    def mes(self, aba, mes):
+        fatia = self.meses[aba].get(mes)
+        return _para_exibicao(fatia if fatia is not None else self.dfs[aba].iloc[0:0])
+
+    def obs(self, aba, mes):
+        fatia = self.observacoes[aba].get(mes)
+        return _para_exibicao(fatia if fatia is not None else self.dfs[aba].iloc[0:0])
+
+    def total(self, aba, mes):
+        totais = self.totais[aba]
+        if mes in totais.index:
+            return totais.loc[mes]
+        return pd.Series(0.0, index=totais.columns)
+
+    def periodos(self, aba, frequencia, inicio, fim):
+        # (somas, valores no fim) das semanas ou meses que tocam o intervalo [inicio, fim]
+        agregado = self.agregados[aba][frequencia]
+        rotulos = agregado['soma'].index
+        proximo = rotulos + pd.tseries.frequencies.to_offset(FREQUENCIAS[frequencia])
+        dentro = (rotulos <= pd.Timestamp(fim)) & (proximo > pd.Timestamp(inicio))
+        return agregado['soma'][dentro], agregado['fim'][dentro]
+
+    def intervalo(self, aba, inicio, fim):
+        # (linhas, linhas com observação) dos dias entre inicio e fim
+        df = self.dfs[aba]
+        dentro = df['Dias'].between(pd.Timestamp(inicio), pd.Timestamp(fim))
+        return _para_exibicao(df[dentro]), _para_exibicao(df[dentro & df['Obs'].notna()])
+
+    def ultimo_dia(self):
+        # Último dia com dados até hoje (a planilha já traz as linhas do resto do ano)
+        dias = self.dfs['PRIMARIO']['Dias']
+        passados = dias[dias <= pd.Timestamp.today()]
+        return (passados if len(passados) else dias).max()
+
+    def ultimo_movimento(self, aba=None):
+        # Último dia com lançamentos (de aba, ou o mais recente entre as abas); sem nenhum,
+        # ultimo_dia(). É o fim dos dados de fato: ultimo_dia() conta as linhas zeradas
+        abas = [aba] if aba else list(self.dfs)
+        dias = [self.dfs[a]['Dias'].iloc[self.movimentos[a]] for a in abas if self.movimentos[a] is not None]
+        return max(dias) if dias else self.ultimo_dia()
+
+
+_snapshot = None
+_lock_atualizacao = threading.Lock()
+_ao_atualizar = []
+
+
+def baixar_planilha(url, etag=None, modificado=None):
+    # Retorna (conteudo, etag, last_modified); conteudo é None quando o arquivo não mudou (304)
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if modificado:
+        headers['If-Modified-Since'] = modificado
+    response = requests.get(url, headers=headers, timeout=TIMEOUT)
+    if response.status_code == 304:
+        return None, etag, modificado
+    if response.status_code == 200:
+        return response.content, response.headers.get('ETag'), response.headers.get('Last-Modified')
+    raise Exception("Falha ao baixar o arquivo do GitHub. Verifique a URL e tente novamente.")
+
+
+# FONTES DA PLANILHA #
+
+# Interface comum: buscar(validadores) retorna (conteudo, validadores, atualizado_em), com
+# conteudo None quando o arquivo não mudou desde a busca que devolveu esses validadores
+class Fonte:
+    # Lida sem rede (pode ser usada na partida)
+    local = False
+
+    def buscar(self, validadores=None):
+        raise NotImplementedError
+
+
+class FonteURL(Fonte):
+    # Requisição condicional (ETag/Last-Modified): 304 quando não mudou
+    def __init__(self, url):
+        self.url = url
+        self.descricao = url
+
+    def buscar(self, validadores=None):
+        validadores = validadores or {}
+        conteudo, etag, modificado = baixar_planilha(self.url, validadores.get('etag'),
+                                                     validadores.get('last_modified'))
+        return conteudo, {'etag': etag, 'last_modified': modificado}, _data_modificacao(modificado)
+
+
+class FonteArquivo(Fonte):
+    # Só lê o arquivo quando o tamanho ou a data de modificação mudam. Um arquivo copiado
+    # pela metade falha na leitura e é lido de novo na rodada seguinte
+    local = True
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.descricao = os.path.abspath(caminho)
+
+    def arquivo(self):
+        return self.caminho
+
+    def buscar(self, validadores=None):
+        caminho = self.arquivo()
+        estado = os.stat(caminho)
+        novos = {'arquivo': os.path.abspath(caminho), 'tamanho': estado.st_size,
+                 'modificado_ns': estado.st_mtime_ns}
+        atualizado_em = datetime.fromtimestamp(estado.st_mtime)
+        if validadores == novos:
+            return None, novos, atualizado_em
+        with open(caminho, 'rb') as f:
+            return f.read(), novos, atualizado_em
+
+
+class FontePasta(FonteArquivo):
+    # A planilha modificada por último na pasta, ignorando temporários do Excel (~$...)
+    def __init__(self, pasta, padrao='*.xlsx'):
+        super().__init__(pasta)
+        self.padrao = padrao
+        self.descricao = os.path.join(os.path.abspath(pasta), padrao)
+
+    def arquivo(self):
+        planilhas = [caminho for caminho in glob.glob(os.path.join(self.caminho, self.padrao))
+                     if not os.path.basename(caminho).startswith(('~$', '.'))]
+        if not planilhas:
+            raise FileNotFoundError(f'Nenhuma planilha {self.padrao} em {self.caminho}')
+        return max(planilhas, key=os.path.getmtime)
+
+
+def criar_fonte(origem=FONTE):
+    if isinstance(origem, Fonte):
+        return origem
+    if origem.startswith(('http://', 'https://')):
+        return FonteURL(origem)
+    if os.path.isdir(origem):
+        return FontePasta(origem)
+    return FonteArquivo(origem)
+
+
+# Nomes de colunas usados no dashboard
+RENOMEAR = {
+    'PRIMARIO': {
+        'Estoque RD': 'Rocha Detonada',
+        'Estoque Rachão': 'Rachão'
+    },
+    'SECUNDARIO': {
+        'Estoque Mac': 'Macadame',
+        'Estoque Po': 'Pó de Pedra',
+        'Estoque Ped': 'Pedrisco',
+        'Estoque B1': 'Brita 1',
+        'Estoque B2': 'Brita 2'
+    },
+    'USA&USS': {}
+}
+
+
+def normalizar_aba(aba, df):
+    # Colunas totalmente vazias ficam float, como no pandas.read_excel
+    vazias = df.columns[df.isna().all()]
+    df[vazias] = df[vazias].astype(float)
+    # Sem observação fica NaN (e não 0), para não misturar números com texto
+    df = df.fillna({coluna: 0 for coluna in df.columns if coluna != 'Obs'}).rename(columns=RENOMEAR[aba])
+    df['Obs'] = df['Obs'].where(df['Obs'] != 0)
+    numericas = df.select_dtypes('number').columns
+    df[numericas] = df[numericas].round(CASAS_DECIMAIS)
+    df['Dias'] = pd.to_datetime(df['Dias'], format='%d/%m/%Y')
+    # Criando uma coluna 'Mês' no formato 'YYYY-MM'
+    df['Mês'] = df['Dias'].dt.strftime('%Y-%m')
+    return df
+
+
+# Tipos compactos guardados em memória (cada worker do gunicorn tem sua cópia).
+# Colunas fora do esquema: float32/int32 quando isso não altera nenhum valor
+ESQUEMA = {
+    'Obs': 'category',
+    'Mês': 'category'
+}
+
+
+def compactar(df):
+    tipos = {}
+    for coluna, tipo in df.dtypes.items():
+        if coluna in ESQUEMA:
+            tipos[coluna] = ESQUEMA[coluna]
+        elif pd.api.types.is_float_dtype(tipo):
+            # float32 guarda ~7 dígitos: só vale se todo valor volta igual com 2 casas
+            compacta = df[coluna].astype('float32')
+            if compacta.astype('float64').round(CASAS_DECIMAIS).equals(df[coluna].astype('float64')):
+                tipos[coluna] = 'float32'
+        elif pd.api.types.is_integer_dtype(tipo):
+            info = np.iinfo('int32')
+            if df.empty or (df[coluna].min() >= info.min and df[coluna].max() <= info.max):
+                tipos[coluna] = 'int32'
+    return df.astype(tipos)
+
+
+def _para_float64(df):
+    # Volta às 2 casas exatas: o float32 84.72 em float64 seria 84.72000122070312
+    floats = [coluna for coluna, tipo in df.dtypes.items() if tipo == 'float32']
+    return df.astype(dict.fromkeys(floats, 'float64')).round(dict.fromkeys(floats, CASAS_DECIMAIS))
+
+
+def _para_exibicao(df):
+    # Gráficos e JSON recebem float64 com 2 casas e texto comum no lugar das categorias
+    return _para_float64(df).astype({coluna: object for coluna, tipo in df.dtypes.items()
+                                     if isinstance(tipo, pd.CategoricalDtype)})
+
+
+def _memoria_kb(df):
+    return df.memory_usage(deep=True).sum() / 1024
+
+
+ERROS_EXCEL = {'#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A'}
+
+
+def _valor_celula(valor):
+    # Como no pandas.read_excel, células vazias ou com erro viram NaN
+    if isinstance(valor, str) and (valor == '' or valor in ERROS_EXCEL):
+        return None
+    return valor
+
+
+def _linhas_planilha(conteudo):
+    # Lê todas as abas de uma vez no modo streaming do openpyxl: só tuplas de valores,
+    # sem montar DataFrames nem objetos de célula
+    from openpyxl import load_workbook
+
+    wb = load_workbook(BytesIO(conteudo), read_only=True, data_only=True, keep_links=False)
+    try:
+        linhas = {}
+        for aba in ABAS:
+            brutas = []
+            for linha in wb[aba].iter_rows(values_only=True):
+                linha = [_valor_celula(valor) for valor in linha]
+                while linha and linha[-1] is None:
+                    linha.pop()
+                brutas.append(linha)
+            while brutas and not brutas[-1]:
+                brutas.pop()
+            largura = max(map(len, brutas), default=0)
+            linhas[aba] = [tuple(linha) + (None,) * (largura - len(linha)) for linha in brutas]
+        return linhas
+    finally:
+        wb.close()
+
+
+def _cabecalho(linha):
+    # Como o pandas: colunas sem nome viram 'Unnamed: i' e nomes repetidos ganham '.1', '.2'...
+    nomes, vistos = [], {}
+    for i, nome in enumerate(linha):
+        nome = f'Unnamed: {i}' if nome is None else nome
+        if nome in vistos:
+            vistos[nome] += 1
+            nome = f'{nome}.{vistos[nome]}'
+        else:
+            vistos[nome] = 0
+        nomes.append(nome)
+    return nomes
+
+
+def _assinatura(linha):
+    return hashlib.blake2b(repr(linha).encode('utf-8'), digest_size=8).digest()
+
+
+def linhas_inalteradas(assinaturas, anteriores):
+    # Quantas linhas de dados iniciais são iguais nas duas versões de uma aba (assinaturas
+    # com o cabeçalho na frente); se o cabeçalho mudou, nenhuma
+    iguais = 0
+    for nova, antiga in zip(assinaturas, anteriores):
+        if nova != antiga:
+            break
+        iguais += 1
+    return max(iguais - 1, 0)
+
+
+def ler_planilha(conteudo, anterior=None):
+    # Devolve ({aba: DataFrame}, assinaturas, {aba: primeira linha alterada}). Com o
+    # snapshot anterior, as linhas iniciais que não mudaram (mesma assinatura) são
+    # reaproveitadas e só as seguintes são convertidas e normalizadas. Como as colunas
+    # de estoque são saldos acumulados, uma correção num dia muda também todos os dias
+    # seguintes: por isso se reaproveita o prefixo inalterado, e não só o que vem
+    # depois do último 'Dias' lido
+    etapas = metricas.Etapas('estoque_carga_segundos')
+    linhas = _linhas_planilha(conteudo)
+    etapas.marcar('leitura')
+    dfs, assinaturas, desde = {}, {}, {}
+    for aba in ABAS:
+        cabecalho, *registros = linhas[aba]
+        assinaturas[aba] = [_assinatura(cabecalho), *map(_assinatura, registros)]
+
+        inicio = 0
+        if anterior is not None and anterior.assinaturas and aba in anterior.assinaturas:
+            inicio = linhas_inalteradas(assinaturas[aba], anterior.assinaturas[aba])
+
+        desde[aba] = inicio
+        if inicio and inicio == len(registros):
+            # Nenhuma linha nova: as anteriores como estão. Normalizar um trecho vazio
+            # deixaria suas colunas float, e a junção passaria as int32 para float32
+            prefixo = anterior.dfs[aba].iloc[:inicio]
+            if inicio < len(anterior.dfs[aba]):
+                # Dias apagados do fim: sem as categorias (meses, observações) que sumiram
+                prefixo = prefixo.assign(**{coluna: prefixo[coluna].cat.remove_unused_categories()
+                                            for coluna, tipo in prefixo.dtypes.items()
+                                            if isinstance(tipo, pd.CategoricalDtype)})
+            dfs[aba] = prefixo
+            etapas.marcar('normalizacao', aba=aba)
+            continue
+        novo = normalizar_aba(aba, pd.DataFrame(registros[inicio:], columns=_cabecalho(cabecalho)))
+        if inicio:
+            novo = pd.concat([_para_float64(anterior.dfs[aba].iloc[:inicio]), novo], ignore_index=True)
+        dfs[aba] = compactar(novo)
+        etapas.marcar('normalizacao', aba=aba)
+        log.info('%s: %d linhas, %.1f KB -> %.1f KB em memória', aba, len(novo),
+                 _memoria_kb(novo), _memoria_kb(dfs[aba]))
+    return dfs, assinaturas, desde
+
+
+# salvar(dfs, assinaturas), se dado, grava o cache e devolve os DataFrames a usar (os
+# mapeados dos arquivos Arrow): assim o snapshot é indexado uma vez só, já sobre eles
+def processar_planilha(conteudo, versao, atualizado_em, anterior=None, salvar=None):
+    dfs, assinaturas, desde = ler_planilha(conteudo, anterior)
+    if anterior is not None:
+        log.info('Leitura incremental: linhas reaproveitadas por aba %s', desde)
+    if salvar is not None:
+        dfs = salvar(dfs, assinaturas)
+    etapas = metricas.Etapas('estoque_carga_segundos')
+    snapshot = Snapshot(dfs, versao, atualizado_em, assinaturas,
+                        base=(anterior, desde) if anterior is not None else None)
+    etapas.marcar('indexacao')
+    return snapshot
+
+
+def _ler_meta():
+    try:
+        with open(CACHE_META, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _escrever_atomico(caminho, escrever):
+    # Grava num temporário e renomeia, para que outro worker nunca leia um arquivo pela metade
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            escrever(f)
+        os.replace(tmp, caminho)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _pyarrow():
+    if not SNAPSHOT_ARROW:
+        return None
+    try:
+        import pyarrow
+        import pyarrow.feather
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def _gravar_arrow(pa, dfs, versao):
+    # Um arquivo por aba, com a versão no nome: gravar uma versão nova não mexe nos
+    # arquivos que outros workers ainda têm mapeados
+    arquivos = {aba: f'planilhas-{versao[:16]}-{i}.arrow' for i, aba in enumerate(dfs)}
+    for aba, nome in arquivos.items():
+        tabela = pa.Table.from_pandas(dfs[aba], preserve_index=False)
+        _escrever_atomico(os.path.join(CACHE_DIR, nome),
+                          lambda f: pa.feather.write_feather(tabela, f, compression='uncompressed'))
+    return arquivos
+
+
+def _mapear_arrow(arquivos):
+    # Colunas numéricas e datas viram arrays numpy (somente leitura) sobre o arquivo
+    # mapeado; só as categorias são copiadas
+    pa = _pyarrow()
+    if pa is None:
+        return None
+    try:
+        return {aba: pa.ipc.open_file(pa.memory_map(os.path.join(CACHE_DIR, nome)))
+                       .read_all().to_pandas(split_blocks=True)
+                for aba, nome in arquivos.items()}
+    except (OSError, pa.ArrowInvalid):
+        log.warning('Não foi possível mapear o snapshot em %s', CACHE_DIR, exc_info=True)
+        return None
+
+
+def _remover_arrow(manter):
+    # Versões antigas: no Linux, quem ainda as tem mapeadas continua lendo até soltá-las
+    for caminho in glob.glob(os.path.join(CACHE_DIR, 'planilhas-*.arrow')):
+        if os.path.basename(caminho) not in manter:
+            try:
+                os.unlink(caminho)
+            except OSError:
+                pass
+
+
+def _ler_cache(meta):
+    try:
+        with open(CACHE_DADOS, 'rb') as f:
+            cache = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    if cache.get('sha') != meta.get('sha'):
+        return None
+    if cache.get('formato') != FORMATO_CACHE:
+        return _reprocessar_planilha(meta, cache['atualizado_em'])
+    if 'arrow' in cache:
+        dfs = _mapear_arrow(cache['arrow'])
+        if dfs is None:
+            return _reprocessar_planilha(meta, cache['atualizado_em'])
+    else:
+        dfs = cache['dfs']
+    return Snapshot(dfs, cache['sha'], cache['atualizado_em'], cache['assinaturas'])
+
+
+def _reprocessar_planilha(meta, atualizado_em):
+    # Cache num formato antigo (ou sem o pyarrow para lê-lo): refaz a partir da cópia
+    # local do arquivo, se houver
+    try:
+        with open(CACHE_PLANILHA, 'rb') as f:
+            conteudo = f.read()
+    except OSError:
+        return None
+    if hashlib.sha256(conteudo).hexdigest() != meta.get('sha'):
+        return None
+    return processar_planilha(conteudo, meta['sha'], atualizado_em,
+                              salvar=lambda dfs, assinaturas: _salvar_cache(
+                                  dfs, meta['sha'], atualizado_em, assinaturas, meta))
+
+
+# Devolve os DataFrames a usar: os mapeados dos arquivos Arrow recém-gravados, para que
+# também este processo compartilhe as páginas com os outros, ou os próprios dfs
+def _salvar_cache(dfs, versao, atualizado_em, assinaturas, meta, conteudo=None):
+    cache = {'sha': versao, 'formato': FORMATO_CACHE,
+             'atualizado_em': atualizado_em, 'assinaturas': assinaturas}
+    pa = _pyarrow()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        if conteudo is not None:
+            _escrever_atomico(CACHE_PLANILHA, lambda f: f.write(conteudo))
+        if pa is not None:
+            cache['arrow'] = _gravar_arrow(pa, dfs, versao)
+        else:
+            cache['dfs'] = dfs
+        _escrever_atomico(CACHE_DADOS, lambda f: pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL))
+    except OSError:
+        log.warning('Não foi possível gravar %s', CACHE_DADOS, exc_info=True)
+        return dfs
+    _salvar_meta(meta)
+    _remover_arrow(set(cache.get('arrow', {}).values()))
+
+    if pa is None:
+        return dfs
+    return _mapear_arrow(cache['arrow']) or dfs
+
+
+def _salvar_meta(meta):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _escrever_atomico(CACHE_META, lambda f: f.write(json.dumps(meta).encode('utf-8')))
+    except OSError:
+        log.warning('Não foi possível gravar %s', CACHE_META, exc_info=True)
+
+
+def _data_modificacao(last_modified):
+    if last_modified:
+        try:
+            return parsedate_to_datetime(last_modified).astimezone()
+        except (TypeError, ValueError):
+            pass
+    return datetime.now()
+
+
+@contextmanager
+def _lock_cache():
+    # Exclusivo entre os processos da máquina (flock). Sem fcntl (Windows) ou sem pasta
+    # de cache gravável, cada processo segue sozinho
+    try:
+        import fcntl
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        arquivo = open(CACHE_LOCK, 'a')
+    except (ImportError, OSError):
+        yield
+        return
+    with arquivo:
+        fcntl.flock(arquivo, fcntl.LOCK_EX)
+        yield
+
+
+def carregar_snapshot(fonte=FONTE, atual=None):
+    # Busca a planilha uma vez e devolve um Snapshot com {aba: DataFrame}. Reaproveita o
+    # cache local (ou o snapshot atual) enquanto a fonte indicar que o arquivo não mudou.
+    # Com o lock, quem chega depois encontra no cache a versão que outro worker acabou
+    # de tratar e só confirma com a fonte que não há outra
+    fonte = criar_fonte(fonte)
+    with _lock_cache():
+        meta = _ler_meta() or {}
+        if atual is None or atual.versao != meta.get('sha'):
+            # O cache em disco pode ter sido atualizado por outro worker
+            atual = _ler_cache(meta) or atual
+
+        mesma_fonte = meta.get('fonte', url_base) == fonte.descricao
+        if atual is not None and mesma_fonte and time.time() - meta.get('verificado_em', 0) < CACHE_VALIDADE:
+            return atual
+
+        condicional = atual is not None and atual.versao == meta.get('sha') and mesma_fonte
+        etapas = metricas.Etapas('estoque_carga_segundos')
+        try:
+            conteudo, validadores, atualizado_em = fonte.buscar(meta.get('validadores') if condicional else None)
+            etapas.marcar('download')
+        except Exception:
+            if atual is None:
+                raise
+            log.warning('Falha ao consultar %s; usando dados em cache (%s)', fonte.descricao,
+                        atual.versao[:12], exc_info=True)
+            return atual
+
+        if conteudo is None:
+            meta['verificado_em'] = time.time()
+            _salvar_meta(meta)
+            return atual
+
+        sha = hashlib.sha256(conteudo).hexdigest()
+        novo_meta = {'sha': sha, 'fonte': fonte.descricao, 'validadores': validadores,
+                     'verificado_em': time.time()}
+        if atual is not None and atual.versao == sha:
+            _salvar_meta(novo_meta)
+            return atual
+
+        return processar_planilha(conteudo, sha, atualizado_em, atual,
+                                  salvar=lambda dfs, assinaturas: _salvar_cache(
+                                      dfs, sha, atualizado_em, assinaturas, novo_meta, conteudo))
+
+
+def snapshot_atual():
+    return _snapshot
+
+
+def ao_atualizar(func):
+    # Registra func(snapshot), chamada (na thread do atualizador) a cada troca de snapshot
+    _ao_atualizar.append(func)
+    return func
+
+
+def carregar_local(atual=None, fonte=FONTE):
+    # Snapshot sem acessar a rede: o cache em disco ou, sem ele, a fonte (se for um
+    # arquivo ou pasta) ou a planilha local. Os dados podem estar defasados; o
+    # atualizador os substitui em seguida
+    if atual is not None:
+        return atual
+    meta = _ler_meta() or {}
+    snapshot = _ler_cache(meta)
+    fonte = criar_fonte(fonte)
+    if snapshot is None and fonte.local:
+        return carregar_snapshot(fonte)
+    if snapshot is None and os.path.exists(PLANILHA_LOCAL):
+        with open(PLANILHA_LOCAL, 'rb') as f:
+            conteudo = f.read()
+        snapshot = processar_planilha(conteudo, hashlib.sha256(conteudo).hexdigest(),
+                                      datetime.fromtimestamp(os.path.getmtime(PLANILHA_LOCAL)))
+    return snapshot
+
+
+def _trocar(carregar):
+    # Carrega fora do caminho das requisições e troca o snapshot de uma vez só;
+    # os callbacks continuam lendo o anterior até a troca
+    global _snapshot
+    with _lock_atualizacao:
+        etapas = metricas.Etapas('estoque_carga_segundos')
+        novo = carregar(_snapshot)
+        etapas.marcar('total')
+        if novo is None or novo is _snapshot:
+            return False
+        _snapshot = novo
+    log.info('Dados atualizados: versão %s (%s)', novo.versao[:12], novo.atualizado_em)
+    for func in _ao_atualizar:
+        try:
+            func(novo)
+        except Exception:
+            log.exception('Falha ao processar a atualização em %s', func.__name__)
+    return True
+
+
+def atualizar(fonte=FONTE):
+    return _trocar(lambda atual: carregar_snapshot(fonte, atual))
+
+
+def iniciar_local(fonte=FONTE):
+    # Só se ainda não há snapshot
+    return _trocar(lambda atual: carregar_local(atual, fonte))
+
+
+@metricas.coletor
+def _coletar():
+    snapshot = _snapshot
+    if snapshot is None:
+        return
+    agora = time.time()
+    yield ('estoque_dados_info', 'gauge', 'Versão (SHA-256 da planilha) dos dados em uso',
+           [({'versao': snapshot.versao}, 1)])
+    yield ('estoque_dados_idade_segundos', 'gauge', 'Tempo desde a última modificação da planilha',
+           [({}, agora - snapshot.atualizado_em.timestamp())])
+    verificado_em = (_ler_meta() or {}).get('verificado_em')
+    if verificado_em:
+        yield ('estoque_dados_verificacao_idade_segundos', 'gauge',
+               'Tempo desde a última consulta bem-sucedida à planilha', [({}, agora - verificado_em)])
+    yield ('estoque_dados_linhas', 'gauge', 'Linhas de cada aba',
+           [({'aba': aba}, len(df)) for aba, df in snapshot.dfs.items()])
+
+
+def iniciar_atualizador(fonte=FONTE, intervalo=INTERVALO_ATUALIZACAO):
+    # Tudo em segundo plano, para o servidor atender (com a página de carregamento) desde
+    # o início: os dados locais, se ainda não houver snapshot, a primeira consulta à
+    # fonte e, se intervalo > 0, as seguintes (para arquivos e pastas, só um stat)
+    fonte = criar_fonte(fonte)
+
+    def loop():
+        try:
+            iniciar_local(fonte)
+        except Exception:
+            log.exception('Falha ao carregar os dados locais')
+        while True:
+            try:
+                atualizar(fonte)
+            except Exception:
+                log.exception('Falha ao atualizar os dados')
+            if _snapshot is None:
+                # Sem dados para mostrar: tenta de novo logo, mesmo com o atualizador desativado
+                time.sleep(min(intervalo, 30) if intervalo > 0 else 30)
+            elif intervalo <= 0:
+                return
+            else:
+                time.sleep(intervalo)
+
+    thread = threading.Thread(target=loop, name='estoque-atualizador', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,210 @@
+import csv
+import hashlib
+import io
+import json
+
+import flask
+
+import dados
+import metricas
+from importacao import tardia
+
+pd = tardia('pandas')
+
+# Rotas de exportação dos relatórios (registradas no servidor Flask do app):
+#
+#   /api/relatorios                                      relatórios disponíveis e versão dos dados
+#   /api/relatorios/secundario.csv?mes=2025-01           vendas e obras por material no mês
+#   /api/relatorios/usinas.xlsx?inicio=2025-01-01&fim=2025-06-30&granularidade=semana
+#
+# Sem mes nem inicio/fim, todos os períodos. Os períodos que tocam o intervalo entram
+# inteiros. As tabelas saem dos agregados por semana/mês já calculados em cada snapshot,
+# e o ETag (versão dos dados + parâmetros) permite ao cliente revalidar sem baixar de novo
+rotas = flask.Blueprint('exportacao', __name__)
+
+# Para cada relatório: aba, nomes das colunas de rótulo e, por linha do relatório
+# (rótulos), as colunas de vendas e obras na planilha
+RELATORIOS = {
+    'secundario': {
+        'aba': 'SECUNDARIO',
+        'rotulos': ['Material'],
+        'linhas': {
+            ('Macadame',): ('Venda Mac', 'Obras Mac'),
+            ('Pó de Pedra',): ('Venda Po', 'Obras Po'),
+            ('Pedrisco',): ('Venda Ped', 'Obras Ped'),
+            ('Brita 1',): ('Venda B1', 'Obras B1'),
+            ('Brita 2',): ('Venda B2', 'Obras B2'),
+        },
+    },
+    'usinas': {
+        'aba': 'USA&USS',
+        'rotulos': ['Usina', 'Produto'],
+        'linhas': {
+            (usina, produto): (f'Vendas {produto}', f'Obras {produto}')
+            for usina, produtos in [('USA', ['CBUQ', 'Binder']), ('USS', ['BGS', 'BGMC', 'BGTC'])]
+            for produto in produtos
+        },
+    },
+}
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'json': 'application/json',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Rótulo de cada período: o mês ou o dia de início da semana
+FORMATO_PERIODO = {'mes': '%Y-%m', 'semana': '%Y-%m-%d'}
+
+# Linhas por bloco enviado nas respostas em streaming (CSV e JSON)
+LINHAS_POR_BLOCO = 500
+
+
+def tabela(snapshot, relatorio, granularidade, inicio, fim):
+    # Uma linha por período e rótulo: Período, rótulos, Vendas (ton.), Obras (ton.)
+    definicao = RELATORIOS[relatorio]
+    soma, _ = snapshot.periodos(definicao['aba'], granularidade, inicio, fim)
+    if soma.empty:
+        return pd.DataFrame(columns=['Período', *definicao['rotulos'], 'Vendas (ton.)', 'Obras (ton.)'])
+    periodos = soma.index.strftime(FORMATO_PERIODO[granularidade])
+    partes = []
+    for ordem, (rotulos, (vendas, obras)) in enumerate(definicao['linhas'].items()):
+        partes.append(pd.DataFrame({
+            'Período': periodos,
+            **{coluna: rotulo for coluna, rotulo in zip(definicao['rotulos'], rotulos)},
+            'Vendas (ton.)': soma[vendas].to_numpy(),
+            'Obras (ton.)': soma[obras].to_numpy(),
+            '_ordem': ordem,
+        }))
+    return (pd.concat(partes, ignore_index=True)
+            .sort_values(['Período', '_ordem'], kind='stable')
+            .drop(columns='_ordem')
+            .reset_index(drop=True))
+
+
+def _blocos(df):
+    for inicio in range(0, len(df), LINHAS_POR_BLOCO):
+        yield df.iloc[inicio:inicio + LINHAS_POR_BLOCO]
+
+
+def gerar_csv(df):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(df.columns)
+    for bloco in _blocos(df):
+        escritor.writerows(bloco.itertuples(index=False))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gerar_json(df, cabecalho):
+    inicio = json.dumps(cabecalho, ensure_ascii=False)[:-1]
+    yield inicio + ', "linhas": ['
+    for i, bloco in enumerate(_blocos(df)):
+        yield (', ' if i else '') + bloco.to_json(orient='records', force_ascii=False)[1:-1]
+    yield ']}'
+
+
+def gerar_xlsx(df, titulo):
+    # O xlsx é um zip, que só fica válido no fim: montado inteiro, no modo de escrita do
+    # openpyxl que não guarda as células em memória
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(titulo[:31])
+    ws.append(list(df.columns))
+    for linha in df.itertuples(index=False):
+        ws.append(list(linha))
+    saida = io.BytesIO()
+    wb.save(saida)
+    return saida.getvalue()
+
+
+def _data(nome):
+    valor = flask.request.args.get(nome)
+    if valor is None:
+        return None
+    try:
+        data = pd.Timestamp(valor)
+    except ValueError:
+        data = pd.NaT
+    # Vazio (?inicio=) vira NaT, sem erro: inválido do mesmo jeito
+    if pd.isna(data):
+        flask.abort(400, f'Data inválida em {nome}: {valor!r} (use AAAA-MM-DD)')
+    return data
+
+
+def _intervalo(snapshot):
+    mes = flask.request.args.get('mes')
+    if mes is not None:
+        try:
+            inicio = pd.Timestamp(f'{mes}-01')
+        except ValueError:
+            inicio = pd.NaT
+        if pd.isna(inicio):
+            flask.abort(400, f'Mês inválido: {mes!r} (use AAAA-MM)')
+        return inicio, inicio + pd.offsets.MonthEnd(0)
+    dias = snapshot.dfs['PRIMARIO']['Dias']
+    inicio, fim = _data('inicio'), _data('fim')
+    return (dias.min() if inicio is None else inicio), (dias.max() if fim is None else fim)
+
+
+@rotas.route('/api/relatorios')
+def listar():
+    snapshot = dados.snapshot_atual()
+    return flask.jsonify({
+        'versao': snapshot.versao if snapshot else None,
+        'atualizado_em': snapshot.atualizado_em.isoformat() if snapshot else None,
+        'relatorios': {nome: {'aba': definicao['aba'], 'rotulos': definicao['rotulos']}
+                       for nome, definicao in RELATORIOS.items()},
+        'formatos': list(FORMATOS),
+        'granularidades': list(FORMATO_PERIODO),
+    })
+
+
+@rotas.route('/api/relatorios/<relatorio>.<any(csv, json, xlsx):formato>')
+def exportar(relatorio, formato):
+    if relatorio not in RELATORIOS:
+        flask.abort(404, f'Relatório desconhecido: {relatorio}')
+    snapshot = dados.snapshot_atual()
+    if snapshot is None:
+        flask.abort(flask.Response('Dados ainda carregando', status=503, headers={'Retry-After': '5'}))
+
+    granularidade = flask.request.args.get('granularidade', 'mes')
+    if granularidade not in FORMATO_PERIODO:
+        flask.abort(400, f'Granularidade inválida: {granularidade!r} (use mes ou semana)')
+    inicio, fim = _intervalo(snapshot)
+
+    # Mesma versão e mesmos parâmetros, mesma resposta: 304 sem montar nada
+    etag = hashlib.sha256(
+        f'{snapshot.versao}:{relatorio}:{formato}:{granularidade}:{inicio:%Y-%m-%d}:{fim:%Y-%m-%d}'.encode()
+    ).hexdigest()[:32]
+    if flask.request.if_none_match.contains(etag):
+        resposta = flask.Response(status=304)
+        resposta.set_etag(etag)
+        return resposta
+
+    etapas = metricas.Etapas('estoque_exportacao_segundos', relatorio=relatorio, formato=formato)
+    df = tabela(snapshot, relatorio, granularidade, inicio, fim)
+    etapas.marcar('tabela')
+    nome = f'estoque-{relatorio}-{granularidade}-{inicio:%Y%m%d}-{fim:%Y%m%d}.{formato}'
+    if formato == 'csv':
+        corpo = gerar_csv(df)
+    elif formato == 'json':
+        corpo = gerar_json(df, {'relatorio': relatorio, 'versao': snapshot.versao,
+                                'granularidade': granularidade,
+                                'inicio': f'{inicio:%Y-%m-%d}', 'fim': f'{fim:%Y-%m-%d}'})
+    else:
+        corpo = gerar_xlsx(df, relatorio)
+        etapas.marcar('xlsx')
+
+    resposta = flask.Response(corpo, mimetype=FORMATOS[formato])
+    resposta.set_etag(etag)
+    resposta.last_modified = snapshot.atualizado_em
+    # Sempre revalidar: o ETag muda quando os dados mudam
+    resposta.headers['Cache-Control'] = 'no-cache'
+    resposta.headers['Content-Disposition'] = f'attachment; filename="{nome}"'
+    return resposta
@@ -0,0 +1,33 @@
+# Configuração do gunicorn para produção: gunicorn -c gunicorn.conf.py Estoque_IIPG:server
+import logging
+import os
+
+logging.basicConfig(level=os.environ.get('ESTOQUE_LOG', 'INFO'))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8050)}"
+
+# Carrega o app uma vez no processo mestre, antes do fork. A importação não toca na rede
+# nem nos dados, então não atrasa a abertura da porta
+preload_app = True
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+accesslog = '-'
+
+
+def when_ready(server):
+    # Com a porta já aberta e antes de criar os workers: o snapshot local (cache em disco
+    # ou planilha do repositório), compartilhado pelos workers por copy-on-write
+    import dados
+    try:
+        dados.iniciar_local()
+    except Exception:
+        server.log.exception('Falha ao carregar os dados locais')
+
+
+def post_fork(server, worker):
+    # Threads não sobrevivem ao fork: cada worker inicia o seu atualizador, que já
+    # consulta a fonte (dados.FONTE) na partida
+    import dados
+    dados.iniciar_atualizador()
@@ -0,0 +1,39 @@
+import importlib
+import threading
+
+# Importação adiada dos módulos pesados (pandas, numpy, plotly.express): o módulo só é
+# importado no primeiro acesso a um atributo, e não na importação do app, para que o
+# servidor abra a porta sem esperar por eles
+#
+#   pd = importacao.tardia('pandas')
+#   ...
+#   pd.DataFrame(...)  # importa o pandas aqui, uma vez só
+
+
+class ModuloTardio:
+    def __init__(self, nome, ao_carregar=None):
+        self._nome = nome
+        self._ao_carregar = ao_carregar
+        self._modulo = None
+        self._lock = threading.Lock()
+
+    def _carregar(self):
+        with self._lock:
+            if self._modulo is None:
+                modulo = importlib.import_module(self._nome)
+                if self._ao_carregar is not None:
+                    self._ao_carregar(modulo)
+                self._modulo = modulo
+        return self._modulo
+
+    def __getattr__(self, atributo):
+        return getattr(self._modulo or self._carregar(), atributo)
+
+    def __repr__(self):
+        estado = 'importado' if self._modulo is not None else 'não importado'
+        return f'<módulo tardio {self._nome!r} ({estado})>'
+
+
+# ao_carregar(módulo) roda uma vez, logo após a importação (p.ex. para configurá-lo)
+def tardia(nome, ao_carregar=None):
+    return ModuloTardio(nome, ao_carregar)
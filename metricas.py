@@ -0,0 +1,200 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+log = logging.getLogger('estoque.metricas')
+
+# Métricas por processo (cada worker do gunicorn tem as suas), expostas em /metrics no
+# formato texto do Prometheus
+
+# Bytes das respostas de callbacks, por callback (ids das saídas): quantidade de
+# respostas, bytes antes da compressão e bytes enviados
+bytes_callbacks = defaultdict(lambda: {'respostas': 0, 'bytes': 0, 'bytes_enviados': 0})
+_lock = threading.Lock()
+
+
+def registrar_bytes(callback, originais, enviados):
+    with _lock:
+        contador = bytes_callbacks[callback]
+        contador['respostas'] += 1
+        contador['bytes'] += originais
+        contador['bytes_enviados'] += enviados
+
+
+# HISTOGRAMAS DE TEMPO #
+
+# Limites (s) dos buckets, do filtro de um mês (~1 ms) à carga da planilha (segundos)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+DESCRICOES = {
+    'estoque_etapa_segundos': 'Tempo de cada etapa dos callbacks (filtro, agregação, figuras, serialização)',
+    'estoque_carga_segundos': 'Tempo de cada etapa da carga dos dados',
+    'estoque_callback_segundos': 'Tempo total das requisições de callbacks, com a compressão',
+    'estoque_exportacao_segundos': 'Tempo para montar cada relatório exportado (sem o envio)',
+}
+
+
+class Histograma:
+    def __init__(self):
+        self.contagens = [0] * len(BUCKETS)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(BUCKETS):
+            if valor <= limite:
+                self.contagens[i] += 1
+        self.soma += valor
+        self.total += 1
+
+
+# (nome, rótulos) -> Histograma
+histogramas = defaultdict(Histograma)
+
+
+def observar(nome, segundos, **rotulos):
+    with _lock:
+        histogramas[(nome, tuple(sorted(rotulos.items())))].observar(segundos)
+
+
+# Cronometra etapas em sequência: cada marcar() registra o tempo desde a marca anterior
+#
+#   etapas = Etapas('estoque_etapa_segundos', secao='primario')
+#   ...filtro...
+#   etapas.marcar('filtro')
+class Etapas:
+    def __init__(self, nome, **rotulos):
+        self.nome = nome
+        self.rotulos = rotulos
+        self.inicio = time.perf_counter()
+
+    def marcar(self, etapa, **rotulos):
+        agora = time.perf_counter()
+        observar(self.nome, agora - self.inicio, **self.rotulos, **rotulos, etapa=etapa)
+        self.inicio = agora
+
+
+# EXPORTAÇÃO #
+
+# Funções que devolvem métricas de outros módulos no momento da exportação:
+# [(nome, tipo, descrição, [(rótulos, valor), ...]), ...]
+_coletores = []
+
+
+def coletor(func):
+    _coletores.append(func)
+    return func
+
+
+@coletor
+def _coletar_bytes():
+    with _lock:
+        contadores = {callback: dict(valores) for callback, valores in bytes_callbacks.items()}
+    for campo, descricao in [('respostas', 'Respostas de callbacks'),
+                             ('bytes', 'Bytes das respostas de callbacks antes da compressão'),
+                             ('bytes_enviados', 'Bytes das respostas de callbacks enviados')]:
+        yield (f'estoque_callback_{campo}_total', 'counter', descricao,
+               [({'callback': callback}, valores[campo]) for callback, valores in contadores.items()])
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(rotulos):
+    if not rotulos:
+        return ''
+    return '{' + ','.join(f'{chave}="{_escapar(valor)}"' for chave, valor in rotulos.items()) + '}'
+
+
+def exportar():
+    linhas = []
+    with _lock:
+        por_nome = defaultdict(list)
+        for (nome, rotulos), histograma in histogramas.items():
+            por_nome[nome].append((dict(rotulos), list(histograma.contagens), histograma.soma,
+                                   histograma.total))
+    for nome, series in sorted(por_nome.items()):
+        linhas += [f'# HELP {nome} {DESCRICOES.get(nome, nome)}', f'# TYPE {nome} histogram']
+        for rotulos, contagens, soma, total in series:
+            for limite, contagem in zip(BUCKETS, contagens):
+                linhas.append(f'{nome}_bucket{_rotulos({**rotulos, "le": limite})} {contagem}')
+            linhas.append(f'{nome}_bucket{_rotulos({**rotulos, "le": "+Inf"})} {total}')
+            linhas.append(f'{nome}_sum{_rotulos(rotulos)} {soma}')
+            linhas.append(f'{nome}_count{_rotulos(rotulos)} {total}')
+
+    for func in _coletores:
+        try:
+            for nome, tipo, descricao, amostras in func():
+                linhas += [f'# HELP {nome} {descricao}', f'# TYPE {nome} {tipo}']
+                linhas += [f'{nome}{_rotulos(rotulos)} {valor}' for rotulos, valor in amostras]
+        except Exception:
+            log.exception('Falha ao coletar métricas em %s', func.__name__)
+    return '\n'.join(linhas) + '\n'
+
+
+# PERFIL DE REQUISIÇÕES LENTAS #
+
+# ESTOQUE_PERFIL=cprofile ou pyinstrument perfila uma fração (ESTOQUE_PERFIL_AMOSTRA) dos
+# callbacks e guarda em ESTOQUE_PERFIL_DIR os que demorarem mais que ESTOQUE_PERFIL_LIMITE s
+PERFIL = os.environ.get('ESTOQUE_PERFIL', '')
+PERFIL_AMOSTRA = float(os.environ.get('ESTOQUE_PERFIL_AMOSTRA', 1))
+PERFIL_LIMITE = float(os.environ.get('ESTOQUE_PERFIL_LIMITE', 0.5))
+PERFIL_DIR = os.environ.get('ESTOQUE_PERFIL_DIR', os.path.join(
+    os.environ.get('ESTOQUE_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')),
+    'perfis'))
+
+# Só um perfilador pode estar ativo por vez: requisições simultâneas ficam sem perfil
+_lock_perfil = threading.Lock()
+
+
+def iniciar_perfil():
+    if not PERFIL or random.random() >= PERFIL_AMOSTRA or not _lock_perfil.acquire(blocking=False):
+        return None
+    try:
+        if PERFIL == 'pyinstrument':
+            from pyinstrument import Profiler
+            perfil = Profiler()
+            perfil.start()
+        else:
+            perfil = cProfile.Profile()
+            perfil.enable()
+    except Exception:
+        _lock_perfil.release()
+        log.exception('Falha ao iniciar o perfil %s', PERFIL)
+        return None
+    return perfil
+
+
+def finalizar_perfil(perfil, nome, segundos):
+    if perfil is None:
+        return
+    try:
+        if PERFIL == 'pyinstrument':
+            perfil.stop()
+        else:
+            perfil.disable()
+    finally:
+        _lock_perfil.release()
+    if segundos < PERFIL_LIMITE:
+        return
+
+    base = os.path.join(PERFIL_DIR, f'{datetime.now():%Y%m%d-%H%M%S}-{segundos * 1000:.0f}ms-'
+                                    f'{re.sub(r"[^A-Za-z0-9_-]+", "_", nome).strip("_")[:80]}')
+    try:
+        os.makedirs(PERFIL_DIR, exist_ok=True)
+        if PERFIL == 'pyinstrument':
+            with open(base + '.html', 'w', encoding='utf-8') as f:
+                f.write(perfil.output_html())
+        else:
+            perfil.dump_stats(base + '.prof')
+    except OSError:
+        log.warning('Não foi possível gravar o perfil em %s', PERFIL_DIR, exc_info=True)
+        return
+    log.info('Requisição lenta (%.0f ms) perfilada em %s', segundos * 1000, base)
@@ -0,0 +1,119 @@
+import fnmatch
+import os
+
+import cache
+
+
+def test_lru_descarta_os_menos_usados_pelos_bytes():
+    lru = cache.CacheLRU(max_bytes=10)
+    lru.guardar('v1:a', b'aaaa')
+    lru.guardar('v1:b', b'bbbb')
+    # Acessar 'a' faz de 'b' o menos usado recentemente
+    assert lru.obter('v1:a') == b'aaaa'
+    lru.guardar('v1:c', b'cccc')
+    assert lru.obter('v1:b') is None
+    assert lru.obter('v1:a') == b'aaaa'
+    assert lru.obter('v1:c') == b'cccc'
+    assert (len(lru), lru.bytes) == (2, 8)
+
+    # Regravar uma chave troca o tamanho dela, sem contar duas vezes
+    lru.guardar('v1:c', b'cc')
+    assert (len(lru), lru.bytes) == (2, 6)
+    # Um item sozinho maior que o limite não entra nem tira os outros
+    lru.guardar('v1:d', b'd' * 11)
+    assert lru.obter('v1:d') is None
+    assert (len(lru), lru.bytes) == (2, 6)
+    # Um item grande tira quantos forem precisos, dos menos usados para os mais usados
+    lru.guardar('v1:e', b'e' * 9)
+    assert [lru.obter(chave) for chave in ('v1:a', 'v1:c')] == [None, None]
+    assert (len(lru), lru.bytes) == (1, 9)
+    assert (lru.acertos, lru.faltas) == (3, 4)
+
+
+def test_lru_descarta_versoes_antigas():
+    lru = cache.CacheLRU(max_bytes=100)
+    lru.guardar('v1:a', b'aaaa')
+    lru.guardar('v2:a', b'bb')
+    lru.guardar('v10:a', b'cccccc')
+    lru.descartar_versoes(exceto='v1')
+    assert lru.obter('v1:a') == b'aaaa'
+    assert lru.obter('v10:a') is None
+    assert (len(lru), lru.bytes) == (1, 4)
+
+
+def test_disco_limita_a_pasta_pelos_menos_usados(tmp_path):
+    disco = cache.CacheDisco(diretorio=str(tmp_path), max_bytes=10)
+    for i, chave in enumerate(['v1:a', 'v1:b', 'v1:c']):
+        disco.guardar(chave, b'x' * 3)
+        os.utime(disco._caminho(chave), (1000 + i, 1000 + i))
+    # Um temporário de outro worker ainda sendo gravado não conta nem é apagado
+    temporario = tmp_path / 'v1' / '.tmp-outro'
+    temporario.write_bytes(b'x' * 100)
+
+    # Ler 'a' marca o acesso: passa a ser o mais recente
+    assert disco.obter('v1:a') == b'xxx'
+    disco.guardar('v1:d', b'x' * 3)
+    os.utime(disco._caminho('v1:d'), (1003, 1003))
+    disco._limitar(str(tmp_path / 'v1'))
+    assert not os.path.exists(disco._caminho('v1:b'))
+    for chave in ('v1:a', 'v1:c', 'v1:d'):
+        assert os.path.exists(disco._caminho(chave))
+    assert temporario.exists()
+
+    disco.max_bytes = 3
+    disco._limitar(str(tmp_path / 'v1'))
+    assert [chave for chave in ('v1:a', 'v1:c', 'v1:d') if os.path.exists(disco._caminho(chave))] == ['v1:a']
+
+
+def test_disco_descarta_versoes_antigas(tmp_path):
+    disco = cache.CacheDisco(diretorio=str(tmp_path / 'figuras'))
+    # Sem pasta ainda: nada a descartar
+    disco.descartar_versoes(exceto='v1')
+    disco.guardar('v1:a', b'a')
+    disco.guardar('v2:a', b'b')
+    disco.guardar('v2:b', b'c')
+    disco.descartar_versoes(exceto='v2')
+    assert sorted(os.listdir(tmp_path / 'figuras')) == ['v2']
+    assert disco.obter('v1:a') is None
+    assert disco.obter('v2:b') == b'c'
+
+
+# Substituto do redis-py: chaves em bytes, como o cliente real sem decode_responses
+class RedisFalso:
+    def __init__(self):
+        self.dados = {}
+        self.ttls = {}
+
+    def get(self, chave):
+        return self.dados.get(chave.encode('utf-8'))
+
+    def set(self, chave, valor, ex=None):
+        self.dados[chave.encode('utf-8')] = valor
+        self.ttls[chave.encode('utf-8')] = ex
+
+    def scan_iter(self, match):
+        return [chave for chave in list(self.dados) if fnmatch.fnmatchcase(chave.decode('utf-8'), match)]
+
+    def delete(self, chave):
+        self.dados.pop(chave, None)
+        self.ttls.pop(chave, None)
+
+
+def test_redis_repassa_o_ttl():
+    cliente = RedisFalso()
+    redis = cache.CacheRedis(cliente, prefixo='p:', ttl=60)
+    redis.guardar('v1:a', b'aaa')
+    assert cliente.ttls == {b'p:v1:a': 60}
+    assert redis.obter('v1:a') == b'aaa'
+    assert redis.obter('v1:b') is None
+    assert (redis.acertos, redis.faltas) == (1, 1)
+
+
+def test_redis_descarta_versoes_antigas():
+    cliente = RedisFalso()
+    cliente.dados[b'outro:v1:a'] = b'de outro app'
+    redis = cache.CacheRedis(cliente, prefixo='p:')
+    for chave in ('v1:a', 'v2:a', 'v10:a', 'v1:b'):
+        redis.guardar(chave, chave.encode('utf-8'))
+    redis.descartar_versoes(exceto='v1')
+    assert sorted(cliente.dados) == [b'outro:v1:a', b'p:v1:a', b'p:v1:b']
@@ -0,0 +1,83 @@
+import io
+from datetime import datetime
+
+import openpyxl
+import pandas as pd
+import pytest
+
+import dados
+
+
+def _salvar(wb):
+    saida = io.BytesIO()
+    wb.save(saida)
+    return saida.getvalue()
+
+
+def _alterar(wb, aba, coluna, linha, valor):
+    ws = wb[aba]
+    ws.cell(row=linha, column=[c.value for c in ws[1]].index(coluna) + 1).value = valor
+
+
+@pytest.fixture(scope='module')
+def planilha():
+    # Valores (e não fórmulas), para que as versões alteradas continuem consistentes
+    return openpyxl.load_workbook(dados.PLANILHA_LOCAL, data_only=True)
+
+
+@pytest.fixture(scope='module')
+def anterior(planilha):
+    return dados.processar_planilha(_salvar(planilha), 'anterior', datetime.now())
+
+
+def _comparar(conteudo, anterior):
+    incremental, assinaturas_inc, desde = dados.ler_planilha(conteudo, anterior)
+    completo, assinaturas, _ = dados.ler_planilha(conteudo)
+    assert assinaturas_inc == assinaturas
+    for aba in dados.ABAS:
+        pd.testing.assert_frame_equal(incremental[aba], completo[aba])
+    return desde
+
+
+def test_planilha_sem_mudancas(planilha, anterior):
+    desde = _comparar(_salvar(planilha), anterior)
+    assert all(desde[aba] == len(anterior.dfs[aba]) for aba in dados.ABAS)
+
+
+def test_planilha_alterada(anterior):
+    planilha = openpyxl.load_workbook(dados.PLANILHA_LOCAL, data_only=True)
+    _alterar(planilha, 'SECUNDARIO', 'Venda Po', 150, 900)
+    _alterar(planilha, 'PRIMARIO', 'Obras RD', 200, 50.25)
+    conteudo = _salvar(planilha)
+    desde = _comparar(conteudo, anterior)
+    assert desde['SECUNDARIO'] == 148
+    assert desde['PRIMARIO'] == 198
+    assert desde['USA&USS'] == len(anterior.dfs['USA&USS'])
+    _comparar_indices(conteudo, anterior)
+
+
+def test_dias_finais_apagados(anterior):
+    # A aba nova é um prefixo da anterior: os meses apagados não podem sobrar
+    planilha = openpyxl.load_workbook(dados.PLANILHA_LOCAL, data_only=True)
+    for aba in dados.ABAS:
+        ws = planilha[aba]
+        ws.delete_rows(ws.max_row - 99, 100)
+    incremental, completo = _comparar_indices(_salvar(planilha), anterior)
+    for aba in dados.ABAS:
+        ultimo_mes = completo.dfs[aba]['Mês'].astype(str).iloc[-1]
+        assert max(incremental.meses[aba]) == ultimo_mes
+        assert incremental.meses[aba][ultimo_mes]['Dias'].max() == completo.dfs[aba]['Dias'].max()
+
+
+def _comparar_indices(conteudo, anterior):
+    # Fatias, observações e totais por mês da indexação incremental e da completa
+    incremental = dados.processar_planilha(conteudo, 'nova', datetime.now(), anterior)
+    completo = dados.processar_planilha(conteudo, 'nova', datetime.now())
+    for aba in dados.ABAS:
+        for indice in ('meses', 'observacoes'):
+            inc, comp = getattr(incremental, indice)[aba], getattr(completo, indice)[aba]
+            assert list(inc) == list(comp)
+            for mes in comp:
+                pd.testing.assert_frame_equal(inc[mes], comp[mes])
+        pd.testing.assert_frame_equal(incremental.totais[aba], completo.totais[aba])
+    return incremental, completo